@@ -0,0 +1,96 @@
+"""
+Cost of N overlapping queries run as separate /search calls vs one /search/batch.
+
+Each simulated query fetches pages, subreddit listings and BigQuery SQL drawn from
+shared pools, the way related business ideas hit the same sources. Every fetch goes
+through utils.dedup like the real tools do, and costs a fixed simulated latency.
+
+    python benchmarks/bench_batch.py [--queries 10] [--concurrency 3]
+"""
+import sys
+import os
+import time
+import random
+import asyncio
+import argparse
+
+# Add the root backend directory to the Python path
+backend_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(backend_root)
+
+from utils.dedup import SharedWork, shared_work_scope, shared_call_async
+
+# Simulated seconds per fetch, and size of the pool each query draws from
+SOURCES = {
+    "page": (0.05, 25, 8),
+    "subreddit_posts": (0.08, 8, 3),
+    "bigquery": (0.2, 5, 2),
+}
+
+def make_queries(count: int, seed: int = 0) -> list[dict]:
+    rng = random.Random(seed)
+    queries = []
+    for _ in range(count):
+        # Popular sources come up more often, like the top results of related searches
+        queries.append({
+            namespace: {int(rng.paretovariate(1.2)) % pool for _ in range(per_query)}
+            for namespace, (_, pool, per_query) in SOURCES.items()
+        })
+    return queries
+
+async def fetch(namespace: str, key: int, spent: list[float]):
+    latency = SOURCES[namespace][0]
+    spent.append(latency)
+    await asyncio.sleep(latency)
+    return f"{namespace}:{key}"
+
+async def run_query(query: dict, spent: list[float]):
+    await asyncio.gather(*(
+        shared_call_async(namespace, key, fetch, namespace, key, spent)
+        for namespace, keys in query.items()
+        for key in keys
+    ))
+
+async def separate(queries: list[dict]) -> tuple[float, list[float], dict]:
+    spent = []
+    executed = {}
+    start = time.perf_counter()
+    for query in queries:
+        # One /search call: sharing only happens inside the query itself
+        with shared_work_scope(SharedWork()) as work:
+            await run_query(query, spent)
+        for namespace, stats in work.stats().items():
+            executed[namespace] = executed.get(namespace, 0) + stats["executed"]
+    return time.perf_counter() - start, spent, executed
+
+async def batch(queries: list[dict], concurrency: int) -> tuple[float, list[float], dict]:
+    spent = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def bounded(query):
+        async with semaphore:
+            await run_query(query, spent)
+
+    start = time.perf_counter()
+    with shared_work_scope(SharedWork()) as work:
+        tasks = [asyncio.create_task(bounded(query)) for query in queries]
+    await asyncio.gather(*tasks)
+    executed = {namespace: stats["executed"] for namespace, stats in work.stats().items()}
+    return time.perf_counter() - start, spent, executed
+
+async def main(count: int, concurrency: int):
+    queries = make_queries(count)
+    requested = {namespace: sum(len(q[namespace]) for q in queries) for namespace in SOURCES}
+    print(f"{count} queries, {sum(requested.values())} fetches requested: {requested}")
+
+    print(f"{'mode':<22}{'wall s':>8}{'fetch s':>9}" + "".join(f"{namespace:>17}" for namespace in SOURCES))
+    for name, run in [("separate /search", separate(queries)), (f"batch (x{concurrency})", batch(queries, concurrency))]:
+        elapsed, spent, executed = await run
+        print(f"{name:<22}{elapsed:>8.2f}{sum(spent):>9.2f}" + "".join(f"{executed.get(namespace, 0):>17}" for namespace in SOURCES))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--queries", type=int, default=10)
+    parser.add_argument("--concurrency", type=int, default=3)
+    args = parser.parse_args()
+    asyncio.run(main(args.queries, args.concurrency))
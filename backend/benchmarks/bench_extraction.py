@@ -0,0 +1,89 @@
+"""
+Event loop latency while 50 pages are parsed, inline vs in the extraction process pool.
+
+A ticker coroutine sleeps 5ms in a loop and records how late it wakes up, which is
+the delay every other SSE stream served by the same loop would see.
+
+    python benchmarks/bench_extraction.py [--pages 50] [--paragraphs 2000]
+"""
+import sys
+import os
+import time
+import asyncio
+import argparse
+import statistics
+
+# Add the root backend directory to the Python path
+backend_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(backend_root)
+
+from utils.extraction import ExtractionService, extract_text
+
+TICK = 0.005
+
+def make_page(index: int, paragraphs: int) -> bytes:
+    body = "".join(
+        f"<div class='c{i % 7}'><p>Page {index} paragraph {i} about market <b>trends</b> and "
+        f"<a href='/l{i}'>opportunities</a>.</p><script>var x{i} = {i};</script></div>"
+        for i in range(paragraphs)
+    )
+    return f"<html><head><title>{index}</title></head><body><header>h</header>{body}<footer>f</footer></body></html>".encode()
+
+async def ticker(lags: list[float], stop: asyncio.Event):
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(TICK)
+        lags.append(time.perf_counter() - start - TICK)
+
+async def measure(name: str, parse_all) -> dict:
+    lags = []
+    stop = asyncio.Event()
+    ticker_task = asyncio.create_task(ticker(lags, stop))
+    await asyncio.sleep(TICK * 4)
+
+    start = time.perf_counter()
+    await parse_all()
+    elapsed = time.perf_counter() - start
+
+    stop.set()
+    await ticker_task
+    lags_ms = sorted(lag * 1000 for lag in lags)
+    return {
+        "name": name,
+        "elapsed_s": elapsed,
+        "ticks": len(lags_ms),
+        "lag_p50_ms": statistics.median(lags_ms),
+        "lag_p99_ms": lags_ms[int(len(lags_ms) * 0.99) - 1] if len(lags_ms) > 1 else lags_ms[-1],
+        "lag_max_ms": lags_ms[-1],
+    }
+
+async def main(pages: int, paragraphs: int, workers: int):
+    documents = [make_page(i, paragraphs) for i in range(pages)]
+    print(f"{pages} pages, {sum(len(d) for d in documents) / 1e6:.1f} MB of HTML")
+
+    async def inline():
+        # What a synchronous tool does: parse on the event loop thread
+        for document in documents:
+            extract_text(document)
+            await asyncio.sleep(0)
+
+    service = ExtractionService(workers=workers, mode="process", timeout=60)
+    service.warm_up()
+
+    async def pooled():
+        await asyncio.gather(*(service.extract_async(document) for document in documents))
+
+    results = [await measure("inline", inline), await measure(f"process pool ({workers} workers)", pooled)]
+    service.shutdown()
+
+    print(f"{'mode':<28}{'total s':>10}{'ticks':>8}{'p50 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for r in results:
+        print(f"{r['name']:<28}{r['elapsed_s']:>10.2f}{r['ticks']:>8}{r['lag_p50_ms']:>10.2f}{r['lag_p99_ms']:>10.2f}{r['lag_max_ms']:>10.2f}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pages", type=int, default=50)
+    parser.add_argument("--paragraphs", type=int, default=2000)
+    parser.add_argument("--workers", type=int, default=min(os.cpu_count() or 1, 4))
+    args = parser.parse_args()
+    asyncio.run(main(args.pages, args.paragraphs, args.workers))
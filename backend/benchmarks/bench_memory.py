@@ -0,0 +1,121 @@
+"""
+Size of a session at the end of a /search run, and resident memory across sequential runs,
+for each way of keeping the agent sessions.
+
+The per-run InMemorySessionService already keeps RSS flat, its sessions go away with it.
+What the bounded store improves is the session itself: compacted to about 7 KB instead of
+about 311 KB, and that session is what the later stages send back to the model.
+
+Each run replays the session events of a GoogleAgent pipeline without any network or
+model call: 10 fetched pages of 20k characters, a sentiment call, 3 BigQuery results
+of 50 KB and the stage outputs. Every mode runs in its own process.
+
+    python benchmarks/bench_memory.py [--runs 1000] [--every 100]
+"""
+import sys
+import os
+import json
+import uuid
+import asyncio
+import argparse
+import subprocess
+
+# Add the root backend directory to the Python path
+backend_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(backend_root)
+
+MODES = {
+    "shared": "one InMemorySessionService, sessions never deleted",
+    "per-run": "an InMemorySessionService per run, like before",
+    "bounded": "shared BoundedSessionService, session deleted after the run",
+}
+
+def rss_mb() -> float:
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+async def simulate_run(service, run: int):
+    from google.adk.events import Event
+    from google.genai import types
+
+    session = await service.create_session(app_name="google_app", user_id="google_user",
+                                           session_id=f"google_session_{uuid.uuid4().hex}")
+    invocation_id = f"run_{run}"
+
+    async def append(author: str, part: types.Part):
+        await service.append_event(session, Event(
+            author=author, invocation_id=invocation_id,
+            content=types.Content(role="user" if author == "user" else "model", parts=[part])
+        ))
+
+    async def call_tool(author: str, name: str, args: dict, response: dict):
+        call_id = uuid.uuid4().hex
+        await append(author, types.Part(function_call=types.FunctionCall(id=call_id, name=name, args=args)))
+        await append(author, types.Part(function_response=types.FunctionResponse(id=call_id, name=name, response=response)))
+
+    await append("user", types.Part(text="online marketplace for used bikes"))
+    urls = [f"https://example.com/{run}/{i}" for i in range(10)]
+    await append("search_agent", types.Part(text=json.dumps({"urls": urls})))
+
+    for url in urls:
+        await call_tool("fetch_website_agent", "fetch_website_content", {"url": url}, {"result": os.urandom(10_000).hex()})
+    await call_tool("fetch_website_agent", "analyze_sentiment", {"urls": urls}, {"average": {"score": 0.2, "magnitude": 3.1}})
+    await append("fetch_website_agent", types.Part(text=json.dumps({"summary": "x" * 1500, "sources": {url: "takeaway" for url in urls}})))
+
+    for i in range(3):
+        rows = [{"year": 2000 + j, "value": j * 1.5, "label": os.urandom(16).hex()} for j in range(500)]
+        await call_tool("bigquery_agent", "run_bigquery_query", {"sql_query": f"SELECT {i}"}, {"result": json.dumps(rows)})
+    await append("bigquery_agent", types.Part(text="[]"))
+    await append("statista_agent", types.Part(text="[]"))
+    return session
+
+async def run_mode(mode: str, runs: int, every: int):
+    from google.adk.sessions import InMemorySessionService
+    from utils.session_store import BoundedSessionService, event_size
+
+    shared = BoundedSessionService() if mode == "bounded" else InMemorySessionService()
+    samples = []
+    session_kb = 0.0
+    for run in range(1, runs + 1):
+        service = InMemorySessionService() if mode == "per-run" else shared
+        session = await simulate_run(service, run)
+        # What the session holds at the end of the run, which the later stages also send to the model
+        stored = service.sessions[session.app_name][session.user_id][session.id]
+        session_kb = max(session_kb, sum(event_size(event) for event in stored.events) / 1024)
+        if mode == "bounded":
+            await service.delete_session(app_name=session.app_name, user_id=session.user_id, session_id=session.id)
+        if run == 1 or run % every == 0:
+            samples.append((run, rss_mb()))
+    print(json.dumps({"samples": samples, "session_kb": session_kb, "stats": shared.stats() if mode == "bounded" else None}))
+
+def main(runs: int, every: int):
+    results = {}
+    for mode in MODES:
+        output = subprocess.run(
+            [sys.executable, __file__, "--mode", mode, "--runs", str(runs), "--every", str(every)],
+            capture_output=True, text=True, check=True
+        ).stdout
+        results[mode] = json.loads(output.strip().splitlines()[-1])
+
+    print("RSS in MB after N runs")
+    print(f"{'runs':>6}" + "".join(f"{mode:>10}" for mode in MODES))
+    for i, (run, _) in enumerate(results["shared"]["samples"]):
+        print(f"{run:>6}" + "".join(f"{results[mode]['samples'][i][1]:>10.1f}" for mode in MODES))
+    print(f"{'KB/session':>6}" + "".join(f"{results[mode]['session_kb']:>10.0f}" for mode in MODES))
+    for mode, description in MODES.items():
+        print(f"{mode:>8}: {description}")
+    print(f"bounded service after the runs: {results['bounded']['stats']}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=1000)
+    parser.add_argument("--every", type=int, default=100)
+    parser.add_argument("--mode", choices=list(MODES))
+    args = parser.parse_args()
+    if args.mode:
+        asyncio.run(run_mode(args.mode, args.runs, args.every))
+    else:
+        main(args.runs, args.every)
@@ -0,0 +1,85 @@
+"""
+Time from the start of search_agent to the end of the page fetches, with and without prefetch.
+
+search_agent takes a scripted time to rank the candidates, then fetch_website_agent fetches
+the URLs it picked, in parallel like the model's tool calls. The picks are mostly the top
+ranked candidates, with a few from further down. Page downloads take a random latency,
+no network call is made. Times are scaled down, 1 scripted second lasting 10 ms.
+
+    python benchmarks/bench_prefetch.py [--runs 200] [--k 10] [--ranking 4]
+"""
+import sys
+import os
+import time
+import random
+import asyncio
+import argparse
+import statistics
+
+# Add the root backend directory to the Python path
+backend_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(backend_root)
+
+from utils.prefetch import Prefetcher
+
+SCALE = 0.01
+CANDIDATES = 30
+
+async def fetch(url: str) -> dict:
+    # Most pages come in 1-3 s, some slow sites take up to 8 s
+    latency = random.uniform(1.0, 3.0) if random.random() < 0.85 else random.uniform(3.0, 8.0)
+    await asyncio.sleep(latency * SCALE)
+    return {"status": "ok", "text": "", "bytes": 200_000}
+
+def pick(candidates: list[str], k: int, off_rank: int) -> list[str]:
+    # The model keeps most of the top ranked candidates and swaps a few for lower ones
+    picks = candidates[:k - off_rank] + random.sample(candidates[k:], off_rank)
+    random.shuffle(picks)
+    return picks
+
+async def run_once(prefetch: bool, k: int, ranking: float, off_rank: int) -> tuple[float, dict | None]:
+    candidates = [f"https://example.com/{i}" for i in range(CANDIDATES)]
+    start = time.perf_counter()
+    prefetcher = Prefetcher(fetch, max_urls=k) if prefetch else None
+    if prefetcher:
+        prefetcher.start(candidates)
+
+    # search_agent ranking the candidates
+    await asyncio.sleep(ranking * SCALE)
+    picks = pick(candidates, k, off_rank)
+
+    async def fetch_pick(url: str):
+        source = await prefetcher.get(url) if prefetcher else None
+        return source or await fetch(url)
+
+    await asyncio.gather(*(fetch_pick(url) for url in picks))
+    if prefetcher:
+        prefetcher.cancel_unused()
+    return (time.perf_counter() - start) / SCALE, prefetcher.stats() if prefetcher else None
+
+async def main(runs: int, k: int, ranking: float, off_rank: int):
+    print(f"{runs} runs, {k} pages picked out of {CANDIDATES} ({off_rank} outside the top {k}), "
+          f"{ranking:g}s of ranking, times in scripted seconds")
+    print(f"{'mode':<12}{'p50':>8}{'p90':>8}{'served':>9}{'wasted':>9}")
+    for prefetch in (False, True):
+        random.seed(0)
+        latencies, served, wasted = [], 0, 0
+        for _ in range(runs):
+            latency, stats = await run_once(prefetch, k, ranking, off_rank)
+            latencies.append(latency)
+            if stats:
+                served += stats["served"]
+                wasted += stats["started"] - stats["served"]
+        latencies.sort()
+        name = "prefetch" if prefetch else "no prefetch"
+        print(f"{name:<12}{statistics.median(latencies):>8.1f}{latencies[int(runs * 0.9) - 1]:>8.1f}"
+              f"{served / runs:>9.1f}{wasted / runs:>9.1f}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--ranking", type=float, default=4.0)
+    parser.add_argument("--off-rank", type=int, default=2)
+    args = parser.parse_args()
+    asyncio.run(main(args.runs, args.k, args.ranking, args.off_rank))
@@ -0,0 +1,120 @@
+"""
+Stage latency and success rate with a fixed model vs the model router, when the preferred
+model of bigquery_agent degrades halfway through: slower, and failing 40% of its calls.
+
+The models are scripted fakes with the same interface as the real ones, the calls go
+through the ADK runner and the same RoutedLlm as the agents. Times are scaled down,
+1 scripted second lasting 10 ms.
+
+    python benchmarks/bench_routing.py [--calls 200] [--target 8]
+"""
+import sys
+import os
+import time
+import random
+import asyncio
+import logging
+import argparse
+import statistics
+from collections import Counter
+
+# Add the root backend directory to the Python path
+backend_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(backend_root)
+
+from google.adk.agents import LlmAgent
+from google.adk.models import BaseLlm, LlmRequest, LlmResponse
+from google.adk.runners import Runner
+from google.adk.sessions import InMemorySessionService
+from google.genai import types
+
+from utils.model_router import ModelRouter
+from utils.routed_llm import RoutedLlm
+
+SCALE = 0.01
+STAGE = "bigquery_agent"
+
+class ScriptedLlm(BaseLlm):
+    """Fake model answering after a scripted latency, or failing with a scripted error."""
+    script: dict
+
+    async def generate_content_async(self, llm_request: LlmRequest, stream: bool = False):
+        behaviour = self.script[llm_request.model]
+        healthy = behaviour["healthy_calls"] is None or behaviour["calls"] < behaviour["healthy_calls"]
+        behaviour["calls"] += 1
+        latency, error_rate = (behaviour["latency"], 0.0) if healthy else (behaviour["degraded_latency"], behaviour["degraded_error_rate"])
+        if random.random() < error_rate:
+            await asyncio.sleep(0.5 * SCALE)
+            raise RuntimeError("503 UNAVAILABLE")
+        await asyncio.sleep(random.uniform(0.7, 1.3) * latency * SCALE)
+        yield LlmResponse(
+            content=types.Content(role="model", parts=[types.Part(text="[]")]),
+            usage_metadata=types.GenerateContentResponseUsageMetadata(candidates_token_count=200)
+        )
+
+def make_script(calls: int) -> dict:
+    return {
+        "gemini-1.5-pro": {"latency": 5.0, "degraded_latency": 12.0, "degraded_error_rate": 0.4, "healthy_calls": calls // 2, "calls": 0},
+        "gemini-2.0-flash": {"latency": 2.0, "degraded_latency": 2.0, "degraded_error_rate": 0.0, "healthy_calls": None, "calls": 0},
+    }
+
+async def run(name: str, candidates: list[str], calls: int, target: float | None) -> dict:
+    random.seed(0)
+    script = make_script(calls)
+    decisions = []
+    model = RoutedLlm(
+        model=candidates[0],
+        stage=STAGE,
+        router=ModelRouter({STAGE: candidates}, prior_latency={model: script[model]["latency"] * SCALE for model in script}),
+        backend=lambda model_name: ScriptedLlm(model=model_name, script=script),
+        # Priors, measurements and target are all in scaled seconds
+        latency_target=(lambda: target * SCALE) if target else None,
+        timeout=10.0 * SCALE,
+        on_decision=decisions.append
+    )
+    agent = LlmAgent(name=STAGE, model=model, instruction="Return []")
+    session_service = InMemorySessionService()
+    runner = Runner(app_name="bench", agent=agent, session_service=session_service)
+
+    latencies, failures = [], 0
+    for i in range(calls):
+        session = await session_service.create_session(app_name="bench", user_id="bench")
+        start = time.perf_counter()
+        try:
+            async for _ in runner.run_async(user_id="bench", session_id=session.id,
+                                            new_message=types.Content(role="user", parts=[types.Part(text="query")])):
+                pass
+            latencies.append((time.perf_counter() - start) / SCALE)
+        except Exception:
+            failures += 1
+        await session_service.delete_session(app_name="bench", user_id="bench", session_id=session.id)
+
+    latencies.sort()
+    return {
+        "name": name,
+        "success": 1 - failures / calls,
+        "p50": statistics.median(latencies) if latencies else float("nan"),
+        "p90": latencies[int(len(latencies) * 0.9) - 1] if latencies else float("nan"),
+        "models": Counter(decision["model"] for decision in decisions if decision["model"]),
+        "fallbacks": sum(len(decision["fallbacks"]) for decision in decisions),
+    }
+
+async def main(calls: int, target: float):
+    logging.getLogger("utils.routed_llm").setLevel(logging.ERROR)
+    results = [
+        await run("fixed gemini-1.5-pro", ["gemini-1.5-pro"], calls, None),
+        await run("routed", ["gemini-1.5-pro", "gemini-2.0-flash"], calls, None),
+        await run(f"routed, {target:.0f}s target", ["gemini-1.5-pro", "gemini-2.0-flash"], calls, target),
+    ]
+    print(f"{calls} calls of {STAGE}, gemini-1.5-pro degrades after {calls // 2}, latencies in scripted seconds")
+    print(f"{'routing':<24}{'success':>9}{'p50':>8}{'p90':>8}{'model errors':>14}  models")
+    for result in results:
+        models = ", ".join(f"{model} x{count}" for model, count in result["models"].most_common())
+        print(f"{result['name']:<24}{result['success']:>9.0%}{result['p50']:>8.1f}{result['p90']:>8.1f}{result['fallbacks']:>14}  {models}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--calls", type=int, default=200)
+    parser.add_argument("--target", type=float, default=8.0)
+    args = parser.parse_args()
+    asyncio.run(main(args.calls, args.target))
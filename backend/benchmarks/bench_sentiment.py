@@ -0,0 +1,84 @@
+"""
+Throughput of the local sentiment engine on a synthetic corpus, one document per call
+(the way pages used to be sent to Cloud NL) vs batches scored in one vectorized pass.
+The Cloud NL row is an estimate from a per-request round trip, no request is sent.
+
+    python benchmarks/bench_sentiment.py [--documents 2000] [--words 1500] [--batch 500]
+
+Short documents, like Reddit comments, gain the most from batching: --documents 20000 --words 40
+"""
+import sys
+import os
+import time
+import random
+import argparse
+
+# Add the root backend directory to the Python path
+backend_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(backend_root)
+
+from utils.sentiment import LexiconSentiment, LEXICON, NEGATIONS, BOOSTERS, SENTIMENT_CLOUD_WORKERS
+
+FILLER = ("the market for this product is in a phase where customers compare prices features "
+          "and support before they buy from small shops or large online retailers").split()
+
+def make_corpus(documents: int, words: int, seed: int = 0) -> list[str]:
+    rng = random.Random(seed)
+    sentiment_words = list(LEXICON)
+    modifiers = list(NEGATIONS) + list(BOOSTERS)
+    corpus = []
+    for _ in range(documents):
+        tokens = []
+        for i in range(words):
+            roll = rng.random()
+            if roll < 0.08:
+                tokens.append(rng.choice(sentiment_words))
+            elif roll < 0.11:
+                tokens.append(rng.choice(modifiers))
+            else:
+                tokens.append(rng.choice(FILLER))
+            if i % 18 == 17:
+                tokens[-1] += rng.choice([".", ".", "!", "?"])
+        corpus.append(" ".join(tokens))
+    return corpus
+
+def measure(name: str, run, corpus: list[str]) -> dict:
+    start = time.perf_counter()
+    results = run()
+    elapsed = time.perf_counter() - start
+    megabytes = sum(len(text) for text in corpus) / 1e6
+    return {"name": name, "elapsed_s": elapsed, "docs_per_s": len(corpus) / elapsed,
+            "mb_per_s": megabytes / elapsed, "results": results}
+
+def main(documents: int, words: int, batch: int, cloud_latency: float):
+    corpus = make_corpus(documents, words)
+    engine = LexiconSentiment()
+    engine.analyze_many(corpus[:10])
+
+    runs = [
+        measure("local, 1 doc per call", lambda: [engine.analyze(text) for text in corpus], corpus),
+        measure(f"local, batches of {batch}", lambda: [
+            result for i in range(0, len(corpus), batch) for result in engine.analyze_many(corpus[i:i + batch])
+        ], corpus),
+        measure("local, single batch", lambda: engine.analyze_many(corpus), corpus),
+    ]
+    # Batching must not change the scores
+    assert all(run["results"] == runs[0]["results"] for run in runs)
+
+    megabytes = sum(len(text) for text in corpus) / 1e6
+    print(f"{documents} documents of {words} words, {megabytes:.1f} MB")
+    print(f"{'engine':<28}{'seconds':>10}{'docs/s':>12}{'MB/s':>10}")
+    for run in runs:
+        print(f"{run['name']:<28}{run['elapsed_s']:>10.2f}{run['docs_per_s']:>12.0f}{run['mb_per_s']:>10.1f}")
+    cloud_elapsed = documents * cloud_latency / SENTIMENT_CLOUD_WORKERS
+    print(f"{'cloud NL (estimated)':<28}{cloud_elapsed:>10.2f}{documents / cloud_elapsed:>12.0f}{megabytes / cloud_elapsed:>10.1f}"
+          f"   {cloud_latency * 1000:.0f}ms per request, {SENTIMENT_CLOUD_WORKERS} in flight")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--documents", type=int, default=2000)
+    parser.add_argument("--words", type=int, default=1500)
+    parser.add_argument("--batch", type=int, default=500)
+    parser.add_argument("--cloud-latency", type=float, default=0.15)
+    args = parser.parse_args()
+    main(args.documents, args.words, args.batch, args.cloud_latency)
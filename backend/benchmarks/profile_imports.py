@@ -0,0 +1,88 @@
+"""
+Cold-start cost of each backend module, measured with `python -X importtime`
+in a fresh interpreter per module, and check that /health stays free of heavy SDKs.
+
+    python benchmarks/profile_imports.py [--top 10] [module ...]
+"""
+import sys
+import os
+import argparse
+import subprocess
+
+backend_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+src_root = os.path.join(backend_root, "src")
+
+MODULES = [
+    "main",
+    "utils.requests",
+    "utils.extraction",
+    "utils.models",
+    "agents.google.google_utils",
+    "agents.google.google_agent",
+]
+
+# None of these may be imported to answer /health
+HEAVY_MODULES = ["google.adk", "google.genai", "google.cloud", "bs4", "pandas", "dotenv"]
+
+HEALTH_CHECK = f"""
+import sys
+from fastapi.testclient import TestClient
+import main
+response = TestClient(main.app).get("/health")
+assert response.status_code == 200, response.status_code
+loaded = [m for m in {HEAVY_MODULES!r} if any(name == m or name.startswith(m + ".") for name in sys.modules)]
+print(",".join(loaded))
+"""
+
+def run_python(args: list[str]) -> subprocess.CompletedProcess:
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([src_root, backend_root]))
+    return subprocess.run([sys.executable, *args], cwd=src_root, env=env, capture_output=True, text=True)
+
+def profile_module(module: str) -> tuple[float, list[tuple[float, str]]]:
+    result = run_python(["-X", "importtime", "-c", f"import {module}"])
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+
+    total = 0.0
+    imports = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative_us, name = line[len("import time:"):].split("|")
+        # Nesting is shown by two spaces of indentation per level, after one separator space
+        name = name[1:].rstrip()
+        cumulative = int(cumulative_us) / 1000
+        # Only the top-level imports of the profiled interpreter add up to its total
+        if not name.startswith(" "):
+            total += cumulative
+        imports.append((cumulative, name.strip()))
+    return total, sorted(imports, reverse=True)
+
+def main(modules: list[str], top: int):
+    print(f"{'module':<32}{'cold import ms':>16}")
+    for module in modules:
+        try:
+            total, imports = profile_module(module)
+        except RuntimeError as e:
+            print(f"{module:<32}{'failed':>16}  {e}")
+            continue
+        print(f"{module:<32}{total:>16.1f}")
+        for cumulative, name in imports[1:top + 1]:
+            print(f"    {name:<44}{cumulative:>10.1f}")
+
+    result = run_python(["-c", HEALTH_CHECK])
+    if result.returncode != 0:
+        print(f"\n/health check failed: {result.stderr.strip().splitlines()[-1]}")
+        sys.exit(1)
+    loaded = [m for m in result.stdout.strip().split(",") if m]
+    if loaded:
+        print(f"\n/health imported heavy modules: {', '.join(loaded)}")
+        sys.exit(1)
+    print("\n/health answered without importing " + ", ".join(HEAVY_MODULES))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("modules", nargs="*", default=MODULES)
+    parser.add_argument("--top", type=int, default=5, help="heaviest dependencies listed per module")
+    args = parser.parse_args()
+    main(args.modules, args.top)
@@ -2,22 +2,30 @@ import sys
 import os
 import asyncio
 import json
+import uuid
 import logging
 from google.adk.agents import BaseAgent, LlmAgent, SequentialAgent
+from google.adk.agents.callback_context import CallbackContext
+from google.adk.models import BaseLlm
 from google.adk.runners import Runner
-from .google_utils import search_google, fetch_website_content
+from . import google_utils
+from .google_utils import search_google
 from google.genai import types
 from pydantic import BaseModel, Field
-from google.adk.sessions import InMemorySessionService
-from dotenv import load_dotenv
-from typing import List, Dict, Any
-from utils.models import run_sentiment_analysis, run_bigquery_query
+from typing import List, Dict, Any, AsyncGenerator, Callable, Optional
+from utils import models
+from utils.env import getenv
+from utils.requests import SafeRequest
+from utils.budget import LatencyBudget, BIGQUERY_MIN_SECONDS
+from utils.snapshots import SnapshotStore, fingerprint, diff_sources
+from utils.bigquery_catalog import get_bigquery_catalog, search_bigquery_tables, format_tables
+from utils.session_store import get_session_service
+from utils.routed_llm import RoutedLlm, routed_model, default_backend
+from utils.prefetch import Prefetcher, PREFETCH_URLS
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-load_dotenv()
-
 # Add the root backend directory to the Python path
 backend_root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 sys.path.append(backend_root)
@@ -30,26 +38,247 @@ class SearchItem(BaseModel):
 class SearchOutput(BaseModel):
     items: List[SearchItem]
 
+# Candidates search_agent ranks. Every 10 results cost one call of the 99 daily CSE calls,
+# a larger pool is opt-in
+SEARCH_RESULTS = int(getenv("GOOGLE_SEARCH_RESULTS", "10"))
+
+# Stage results that do not depend on the websites, and the result field holding them
+REUSABLE_RESULTS = {
+    "bigquery_agent": "bigquery_metrics",
+    "statista_agent": "statista_insights"
+}
+
 class GoogleAgent():
 
-    def __init__(self, query: str, k: int = 10):
+    def __init__(self, query: str, k: int = 10, num_results: int = SEARCH_RESULTS, time_budget: float | None = None,
+                 refresh: bool = False, model_backend: Callable[[str], BaseLlm] | None = None):
         self.query = query
         self.k = k
-        self.search_results = search_google(self.query)
+        self.budget = LatencyBudget(time_budget)
+        # The models of the stages are chosen by the model router, model_backend replaces the real models
+        self.model_backend = model_backend
+        self.routing = []
+        # In refresh mode, only the websites that changed since the previous analysis are analyzed again
+        self.snapshot_store = SnapshotStore()
+        self.previous = self.snapshot_store.load("google", query) if refresh else None
+        self.sources = {}
+        # Text of the fetched websites, scored in one batch by the sentiment tool
+        self.page_texts = {}
+        self.prefetcher = None
+        self.refresh_delta = None
+        # The search agent picks the k URLs it returns out of num_results candidates
+        self.num_results = max(num_results, k)
+        # The budget starts now, the search has to fit in it too
+        deadline = SafeRequest.deadline_in(self.budget.remaining()) if self.budget.is_limited else None
+        self.search_results = search_google(self.query, num=self.num_results, deadline=deadline)
         self.bigquery_metrics = []
         self.statista_insights = []
         self.final_summary = ""
         self.agent_errors = {}
 
+    def build_tools(self):
+        # The tools keep the names the instructions refer to, and read the latency budget when called
+
+        async def fetch_website_content(url: str) -> str:
+            """
+            Fetch a website and return the text content of its body.
+            """
+            timeout = self.budget.stage_remaining("fetch_website_agent")
+            if timeout <= 0:
+                self.budget.degrade("fetch_website_agent", "skip_url", f"{url} not fetched, time budget exhausted")
+                return "Time budget exhausted, summarize with the content already fetched."
+
+            timeout = timeout if self.budget.is_limited else None
+            try:
+                # Usually already fetched by the prefetcher, or on its way
+                source = await asyncio.wait_for(self.prefetcher.get(url), timeout) if self.prefetcher else None
+            except asyncio.TimeoutError:
+                self.budget.degrade("fetch_website_agent", "skip_url", f"{url} not fetched, time budget exhausted")
+                return "Time budget exhausted, summarize with the content already fetched."
+            if source is None or source['status'] == 'error':
+                source = await self.fetch_source(url, timeout)
+            previous_source = self.get_previous_sources().get(url, {})
+            if source['status'] == 'error':
+                if not previous_source:
+                    return ""
+                # A page failing for a moment keeps its previous analysis rather than counting as removed
+                self.sources[url] = {key: value for key, value in previous_source.items() if key != 'takeaway'}
+                return f"Could not be fetched this time, keep its previous takeaway: {previous_source.get('takeaway')}"
+
+            if source['status'] == 'not_modified':
+                source_fingerprint = previous_source['fingerprint']
+            else:
+                source_fingerprint = fingerprint(source['text'])
+            self.sources[url] = {
+                'fingerprint': source_fingerprint,
+                'etag': source['etag'],
+                'last_modified': source['last_modified']
+            }
+
+            if previous_source.get('fingerprint') == source_fingerprint:
+                # The text is not fetched again, its previous sentiment still holds
+                if previous_source.get('sentiment'):
+                    self.sources[url]['sentiment'] = previous_source['sentiment']
+                return f"UNCHANGED since the previous analysis. Previous takeaway: {previous_source.get('takeaway')}"
+
+            max_chars = self.budget.page_chars(url)
+            text = source['text'][:max_chars] if max_chars else source['text']
+            self.page_texts[url] = text
+            return text
+
+        def analyze_sentiment(urls: list[str]) -> dict:
+            """
+            Run sentiment analysis on the content of the fetched websites, all of them in one call.
+            Returns the sentiment score and magnitude of each website, and their average.
+            """
+            fetched = [url for url in urls if self.page_texts.get(url)]
+            for url, (score, magnitude) in zip(fetched, models.run_sentiment_analysis_many([self.page_texts[url] for url in fetched])):
+                self.sources[url]['sentiment'] = [score, magnitude]
+            # Websites unchanged since the previous analysis keep their previous sentiment
+            results = {
+                url: tuple(self.sources[url]['sentiment'])
+                for url in urls if self.sources.get(url, {}).get('sentiment')
+            }
+            websites = {
+                url: {"score": results[url][0], "magnitude": results[url][1]} if url in results else "not fetched"
+                for url in urls
+            }
+            if not results:
+                return {"websites": websites, "average": None}
+            return {
+                "websites": websites,
+                "average": {
+                    "score": round(sum(score for score, _ in results.values()) / len(results), 3),
+                    "magnitude": round(sum(magnitude for _, magnitude in results.values()) / len(results), 3)
+                }
+            }
+
+        def run_bigquery_query(sql_query: str):
+            """
+            Run a bigquery query and return the results.
+            """
+            timeout = self.budget.stage_remaining("bigquery_agent")
+            return models.run_bigquery_query(sql_query, timeout=timeout if self.budget.is_limited else None)
+
+        return fetch_website_content, analyze_sentiment, run_bigquery_query
+
+    async def fetch_source(self, url: str, timeout: float | None = None) -> Dict[str, Any]:
+        # Conditional when the previous analysis saw the page
+        previous_source = self.get_previous_sources().get(url, {})
+        return await google_utils.fetch_website_source_async(
+            url,
+            etag=previous_source.get('etag'),
+            last_modified=previous_source.get('last_modified'),
+            timeout=timeout
+        )
+
+    def _after_fetch_stage(self, callback_context: CallbackContext) -> Optional[types.Content]:
+        # The agent is done fetching, the candidates it did not pick are not needed
+        if self.prefetcher:
+            self.prefetcher.cancel_unused()
+        return None
+
+    def get_previous_sources(self) -> Dict[str, Dict[str, Any]]:
+        return self.previous.get("sources", {}) if self.previous else {}
+
+    def get_reusable_result(self, stage: str) -> list | None:
+        """
+        The previous result of a stage a refresh can reuse, None when the stage has to run again:
+        its previous result is empty, or came from a run where the stage failed or was degraded.
+        """
+        if not self.previous or stage not in REUSABLE_RESULTS:
+            return None
+        result = self.previous["result"]
+        degradations = (result.get("budget") or {}).get("degradations", [])
+        if stage in (result.get("errors") or {}) or any(degradation["stage"] == stage for degradation in degradations):
+            return None
+        return result.get(REUSABLE_RESULTS[stage]) or None
+
+    def get_refresh_instruction(self) -> str:
+        if not self.previous:
+            return ""
+        candidates = {item.get('link') for item in self.search_results}
+        removed = [url for url in self.get_previous_sources() if url not in candidates]
+        return f"""
+        This is a refresh of a previous analysis. Here is the previous summary:
+        {self.previous["result"].get("summary", "")}
+
+        These websites are no longer in the search results, drop what only came from them: {json.dumps(removed)}
+
+        When the tool answers that a website is UNCHANGED, do not analyze it again: reuse its previous takeaway as is.
+        Update the previous summary with what the new and changed websites bring.
+        """
+
+    def _before_stage(self, callback_context: CallbackContext) -> Optional[types.Content]:
+        stage = callback_context.agent_name
+        self.budget.start_stage(stage)
+
+        # The metrics do not depend on the websites, a refresh reuses the previous ones
+        previous_result = self.get_reusable_result(stage)
+        if previous_result is not None:
+            logger.info(f"♻️ Reusing previous {REUSABLE_RESULTS[stage]}")
+            return types.Content(role="model", parts=[types.Part(text=json.dumps(previous_result))])
+
+        if stage == "bigquery_agent" and self.budget.should_skip(stage, BIGQUERY_MIN_SECONDS):
+            return types.Content(role="model", parts=[types.Part(text="[]")])
+
+        return None
+
+    def route_model(self, stage: str, default: str) -> RoutedLlm:
+        # Under a time budget, the router picks a model expected to answer within what the stage has left
+        return routed_model(
+            stage,
+            default,
+            backend=self.model_backend or default_backend,
+            latency_target=(lambda: self.budget.stage_remaining(stage)) if self.budget.is_limited else None,
+            on_decision=self._record_routing
+        )
+
+    def _record_routing(self, decision: Dict[str, Any]):
+        self.routing.append(decision)
+        # A switch made for the time budget is one of its degradations, not one made for the configured targets
+        if (self.budget.is_limited and decision["model"] and decision["model"] != decision["preferred"]
+                and decision["reason"] in ("latency_target", "fastest")):
+            self.budget.degrade(decision["stage"], "switch_model", f"{decision['preferred']} replaced by {decision['model']}")
+
+    async def _within_budget(self, events: AsyncGenerator) -> AsyncGenerator:
+        # Stops the pipeline early so the final result can still be emitted by the deadline.
+        # The events are read in the caller's task, the runner sets context variables that
+        # have to be reset from the same context, and the deadline only covers the reads:
+        # the caller's own time between two events is not cut short by a cancellation.
+        deadline = asyncio.get_running_loop().time() + self.budget.remaining() if self.budget.is_limited else None
+        try:
+            while True:
+                try:
+                    async with asyncio.timeout_at(deadline):
+                        event = await events.__anext__()
+                except StopAsyncIteration:
+                    break
+                except TimeoutError:
+                    self.budget.degrade("pipeline", "deadline_reached", "stopped before all stages completed")
+                    logger.warning("⏱️ Time budget exhausted, returning partial results")
+                    break
+                yield event
+        finally:
+            await events.aclose()
+
     async def initialize_agents(self):
+        fetch_website_content, analyze_sentiment, run_bigquery_query = self.build_tools()
+        url_count = self.budget.url_count(self.k)
+
+        # The top candidates are fetched while search_agent is still ranking them
+        prefetch_timeout = self.budget.remaining() if self.budget.is_limited else None
+        self.prefetcher = Prefetcher(lambda url: self.fetch_source(url, prefetch_timeout), max_urls=min(PREFETCH_URLS, url_count))
+        self.prefetcher.start([item.get('link') for item in self.search_results])
+
         SEARCH_INSTRUCTION = f"""
         You are a search agent that can search the web for information given a query.
-        Your role is to analyze the search results and return the {self.k} most relevant URLs
+        Your role is to analyze the search results and return the {url_count} most relevant URLs
         that will bring the most value to the user, business-wise and opportunity-wise.
 
         Here is the query: {self.query}
 
-        Here are the search results: {json.dumps(self.search_results, indent=2)}
+        Here are the search results: {json.dumps(self.get_search_candidates(), indent=2)}
 
         Return only the URLs of the most relevant results, one per line, then hand off to the next agent to fetch and analyze the content.
         Here is the format of the output:
@@ -71,11 +300,12 @@ class GoogleAgent():
             name="search_agent",
             description="A search agent that can search the web for information given a query",
             instruction=SEARCH_INSTRUCTION,
-            model="gemini-2.0-flash",
+            model=self.route_model("search_agent", "gemini-2.0-flash"),
             generate_content_config=types.GenerateContentConfig(
                 temperature=0.3
             ),
-            disallow_transfer_to_parent=True
+            disallow_transfer_to_parent=True,
+            before_agent_callback=self._before_stage
         )
 
         FETCH_WEBSITE_INSTRUCTION = f"""
@@ -86,8 +316,8 @@ class GoogleAgent():
         say so.
 
         Also, you should analyze the sentiment of the content of the websites and return the sentiment score and magnitude.
-        You have a tool to run sentiment analysis on the content of the websites.
-        The final sentiment score and magnitude is the average of the sentiment scores and magnitudes of the websites.
+        Once the websites are fetched, call the analyze_sentiment tool once with all their URLs.
+        The final sentiment score and magnitude is the average it returns.
 
         Your summary should:
         - Be in the same language as the query
@@ -97,12 +327,16 @@ class GoogleAgent():
         - Contain no more than 300 words.
 
         Here is the query: {self.query}
-
-        Here is the format of the output:
+        {self.get_refresh_instruction()}
+        Here is the format of the output, with a one or two sentence takeaway for each website:
         {{
             "summary": "...",
             "sentiment_score": ...,
-            "sentiment_magnitude": ...
+            "sentiment_magnitude": ...,
+            "sources": {{
+                "url1": "takeaway",
+                ...
+            }}
         }}
 
         DO NOT include "```json" or "```" in your response.
@@ -113,15 +347,20 @@ class GoogleAgent():
             name="fetch_website_agent",
             description="A agent that can fetch the content of a website",
             instruction=FETCH_WEBSITE_INSTRUCTION,
-            model="gemini-2.0-flash",
-            tools=[fetch_website_content],
+            model=self.route_model("fetch_website_agent", "gemini-2.0-flash"),
+            tools=[fetch_website_content, analyze_sentiment],
             generate_content_config=types.GenerateContentConfig(
                 temperature=0.3
             ),
             disallow_transfer_to_parent=True,
-            disallow_transfer_to_peers=True
+            disallow_transfer_to_peers=True,
+            before_agent_callback=self._before_stage,
+            after_agent_callback=self._after_fetch_stage
         )
 
+        # Grounding the agent in real schemas avoids SQL against tables or columns that do not exist
+        candidate_tables = format_tables(get_bigquery_catalog().search(self.query, k=5)) or "(no table matched the query)"
+
         BIGQUERY_INSTRUCTION = f"""
         You are a data analysis agent that can query BigQuery public datasets to find real-world statistics.
         Your task is to find any relevant metrics, growth trends, or economic indicators for the following user query:
@@ -129,8 +368,12 @@ class GoogleAgent():
         User query: "{self.query}"
 
         You have to write SQL queries to find the most relevant metrics, growth trends, or economic indicators related to the user query.
-        Then you have to run the SQL queries to get the data, using the function tool I gave you.
-        You can use any public dataset available in BigQuery.
+        Then you have to run the SQL queries to get the data, using the run_bigquery_query tool.
+        These public tables are the most likely to be relevant, with their exact columns:
+{candidate_tables}
+
+        Only use tables and columns listed above. If none of them fits, look for other tables with the
+        search_bigquery_tables tool, giving it a few keywords, and use the tables and columns it returns.
         You have to return numbers as metrics in the field "value".
 
         Return a JSON output being a list of objects with the following structure:
@@ -150,11 +393,12 @@ class GoogleAgent():
             name="bigquery_agent",
             description="Queries BigQuery for economic/market metrics",
             instruction=BIGQUERY_INSTRUCTION,
-            model="gemini-1.5-pro",
-            tools=[run_bigquery_query],
+            model=self.route_model("bigquery_agent", "gemini-1.5-pro"),
+            tools=[run_bigquery_query, search_bigquery_tables],
             generate_content_config=types.GenerateContentConfig(temperature=0.3),
             disallow_transfer_to_parent=True,
-            disallow_transfer_to_peers=True
+            disallow_transfer_to_peers=True,
+            before_agent_callback=self._before_stage
         )
 
         STATISTA_INSTRUCTION = f"""
@@ -182,10 +426,11 @@ class GoogleAgent():
             name="statista_agent",
             description="Synthesizes insights similar to Statista market summaries",
             instruction=STATISTA_INSTRUCTION,
-            model="gemini-2.0-flash",
+            model=self.route_model("statista_agent", "gemini-2.0-flash"),
             generate_content_config=types.GenerateContentConfig(temperature=0.3),
             disallow_transfer_to_parent=True,
-            disallow_transfer_to_peers=True
+            disallow_transfer_to_peers=True,
+            before_agent_callback=self._before_stage
         )
 
         self.sequential_agent = SequentialAgent(
@@ -199,9 +444,11 @@ class GoogleAgent():
             description="Performs a full research + data insight analysis",
         )
 
-        self.session_service = InMemorySessionService()
+        # One service for every run of the process, each run in its own session
+        self.session_service = get_session_service()
+        self.session_id = f"google_session_{uuid.uuid4().hex}"
         self.session = await self.session_service.create_session(
-            session_id="google_session",
+            session_id=self.session_id,
             user_id="google_user",
             app_name="google_app"
         )
@@ -212,6 +459,19 @@ class GoogleAgent():
             session_service=self.session_service,
         )
 
+        # The search results are in the instructions now, the raw results are not needed anymore
+        self.search_results = None
+
+    def get_search_candidates(self) -> List[Dict[str, Any]]:
+        return [
+            SearchItem(
+                title=item.get('title', ''),
+                link=item.get('link', ''),
+                snippet=item.get('snippet', '')
+            ).model_dump()
+            for item in self.search_results
+        ]
+
     def parse_json_response(self, text: str):
         try:
             text = text.strip()
@@ -225,12 +485,13 @@ class GoogleAgent():
 
     async def call_agent_async(self):
         final_response = None
+        events = self._within_budget(self.runner_agent.run_async(
+            session_id=self.session_id,
+            user_id="google_user",
+            new_message=types.Content(parts=[types.Part(text=self.query)])
+        ))
         try:
-            async for event in self.runner_agent.run_async(
-                session_id="google_session",
-                user_id="google_user",
-                new_message=types.Content(parts=[types.Part(text=self.query)])
-            ):
+            async for event in events:
                 yield event
                 if event.is_final_response():
                     if event.content and event.content.parts[0].text:
@@ -280,11 +541,28 @@ class GoogleAgent():
                 error_msg = "❌ No final response received"
                 logger.error(error_msg)
                 self.agent_errors["final"] = error_msg
+            else:
+                self.save_snapshot()
                 
         except Exception as e:
             error_msg = f"Fatal error in agent execution: {str(e)}"
             logger.error(error_msg)
             self.agent_errors["fatal"] = error_msg
+        finally:
+            # Closed here when the loop breaks early, not later by the garbage collector in another context
+            await events.aclose()
+            await self.close_session()
+
+    async def close_session(self):
+        # The results are kept on the agent, the session and the fetched pages can go
+        self.page_texts = {}
+        if self.prefetcher:
+            self.prefetcher.cancel_unused()
+        await self.session_service.delete_session(
+            app_name="google_app",
+            user_id="google_user",
+            session_id=self.session_id
+        )
 
     def get_structured_results(self) -> Dict[str, Any]:
         return {
@@ -292,9 +570,45 @@ class GoogleAgent():
             "bigquery_metrics": self.bigquery_metrics,
             "statista_insights": self.statista_insights,
             "timestamp": asyncio.get_event_loop().time(),
-            "errors": self.agent_errors if self.agent_errors else None
+            "errors": self.agent_errors if self.agent_errors else None,
+            "budget": self.budget.summary(),
+            "refresh": self.refresh_delta,
+            "routing": self.routing,
+            "prefetch": self.prefetcher.stats() if self.prefetcher else None
         }
 
+    def save_snapshot(self):
+        summary = self.parse_json_response(self.final_summary)
+        takeaways = summary.get("sources", {}) if isinstance(summary, dict) else {}
+        previous_sources = self.get_previous_sources()
+
+        sources = {}
+        for url, source in self.sources.items():
+            previous_source = previous_sources.get(url, {})
+            takeaway = takeaways.get(url)
+            if takeaway is None and previous_source.get('fingerprint') == source['fingerprint']:
+                takeaway = previous_source.get('takeaway')
+            sources[url] = {**source, 'takeaway': takeaway}
+
+        if self.previous:
+            self.refresh_delta = diff_sources(
+                {url: source['fingerprint'] for url, source in previous_sources.items()},
+                {url: source['fingerprint'] for url, source in sources.items()}
+            )
+            logger.info("♻️ Refresh: " + ", ".join(f"{len(urls)} {status}" for status, urls in self.refresh_delta.items()))
+
+        # A run stopped by its time budget would leave a partial snapshot behind
+        if any(degradation["action"] == "deadline_reached" for degradation in self.budget.degradations):
+            return
+        try:
+            self.snapshot_store.save("google", self.query, {
+                "query": self.query,
+                "sources": sources,
+                "result": self.get_structured_results()
+            })
+        except OSError as e:
+            logger.warning(f"Could not save the analysis snapshot: {e}")
+
     async def run(self):
         await self.initialize_agents()
         await self.call_agent_async()
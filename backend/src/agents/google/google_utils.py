@@ -2,65 +2,204 @@ import sys
 import os
 import asyncio
 import time
-from dotenv import load_dotenv
-import bs4
-
-load_dotenv()
-
-# Google API key and custom search engine ID
-GOOGLE_CUSTOM_SEARCH_API = os.getenv("GOOGLE_CUSTOM_SEARCH_API")
-GOOGLE_CX = os.getenv("GOOGLE_CX")
-
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Iterator
 
 # Add the root backend directory to the Python path
 backend_root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
 sys.path.append(backend_root)
 
-import requests
 import json
+from utils.env import getenv
 from utils.requests import SafeRequest
+from utils.extraction import get_extraction_service
+from utils.dedup import shared_call, shared_call_async
+
+# Google API key and custom search engine ID
+GOOGLE_CUSTOM_SEARCH_API = getenv("GOOGLE_CUSTOM_SEARCH_API")
+GOOGLE_CX = getenv("GOOGLE_CX")
 
 BASE_URL = "https://www.googleapis.com/customsearch/v1"
 
+# Slow websites get a duplicate request after this many seconds, the fastest answer wins
+WEBSITE_HEDGE_AFTER = float(getenv("WEBSITE_HEDGE_AFTER", "3.0"))
+WEBSITE_DEADLINE = float(getenv("WEBSITE_DEADLINE", "20.0"))
+
 link_example = "https://www.coe.int/en/web/interculturalcities/paris"
 
-def search_google(query: str, api_key: str = GOOGLE_CUSTOM_SEARCH_API, cx: str = GOOGLE_CX, num: int = 10) -> list[dict]:
+# The CSE API returns at most 10 results per call and never goes past the 100th result
+RESULTS_PER_PAGE = 10
+MAX_RESULTS = 100
+
+def _search_params(query: str, api_key: str, cx: str, start: int, num: int) -> dict:
+    return {
+        'q': query,
+        'cx': cx,
+        'num': num,
+        'start': start,
+        'key': api_key
+    }
+
+def _search_google_page(query: str, api_key: str, cx: str, start: int, num: int,
+                        deadline: float | None = None) -> list[dict]:
+    params = _search_params(query, api_key, cx, start, num)
+    # Queries of a batch searching the same page share a single request
+    response = shared_call("google_page", SafeRequest._google_cache_key(BASE_URL, params),
+                           lambda: SafeRequest.google_request(BASE_URL, params, deadline=deadline))
+
+    if response and response.get('items'):
+        return response['items']
+    return []
+
+def _plan_search_pages(query: str, api_key: str, cx: str, num: int) -> list[tuple[int, int]]:
+    pages = []
+    quota = SafeRequest.google_quota_remaining()
+
+    for start in range(1, min(num, MAX_RESULTS) + 1, RESULTS_PER_PAGE):
+        page_size = min(RESULTS_PER_PAGE, num - start + 1)
+        # Cached pages do not count against the daily quota
+        if SafeRequest.is_google_cached(BASE_URL, _search_params(query, api_key, cx, start, page_size)):
+            pages.append((start, page_size))
+        elif quota > 0:
+            pages.append((start, page_size))
+            quota -= 1
+
+    return pages
+
+def iter_search_google(query: str, api_key: str = GOOGLE_CUSTOM_SEARCH_API, cx: str = GOOGLE_CX,
+                       num: int = 10, max_workers: int = 4, deadline: float | None = None) -> Iterator[list[dict]]:
+    """
+    Fetch the result pages needed to reach `num` results concurrently and yield
+    the new, deduplicated items of each page as soon as it arrives.
+    Every item gets a `rank` field with its position in the Google ranking.
+    `deadline` (time.monotonic) bounds every page request, retries included.
+    Pages can arrive out of order: a link already yielded is yielded again when
+    a lower page ranks it better, consumers keep the lowest `rank` of each link.
+    """
+    pages = _plan_search_pages(query, api_key, cx, num)
+    if len(pages) * RESULTS_PER_PAGE < min(num, MAX_RESULTS):
+        print(f"Google API quota too low, fetching {len(pages)} pages for {num} results")
+    if not pages:
+        return
+
+    best_ranks = {}
+    executor = ThreadPoolExecutor(max_workers=min(max_workers, len(pages)))
     try:
-        params = {
-            'q': query,
-            'cx': cx,
-            'num': num,
-            'key': api_key
+        # Each page runs in the caller's context, to share work with the rest of its batch
+        futures = {
+            executor.submit(contextvars.copy_context().run, _search_google_page, query, api_key, cx, start, page_size, deadline): start
+            for start, page_size in pages
         }
 
-        response = SafeRequest.google_request(BASE_URL, params=params)
+        for future in as_completed(futures):
+            start = futures[future]
+            try:
+                items = future.result()
+            except Exception as e:
+                print(f"Error searching Google (start={start}): {e}")
+                continue
+
+            new_items = []
+            for i, item in enumerate(items):
+                link, rank = item.get('link'), start + i
+                if link in best_ranks and best_ranks[link] <= rank:
+                    continue
+                best_ranks[link] = rank
+                new_items.append({**item, 'rank': rank})
+
+            if new_items:
+                yield new_items
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+def search_google(query: str, api_key: str = GOOGLE_CUSTOM_SEARCH_API, cx: str = GOOGLE_CX, num: int = 10,
+                  deadline: float | None = None) -> list[dict]:
+    try:
+        # A link on several pages keeps its best rank, whichever page came back first
+        results = {}
+        for items in iter_search_google(query, api_key, cx, num, deadline=deadline):
+            for item in items:
+                link = item.get('link')
+                if link not in results or item['rank'] < results[link]['rank']:
+                    results[link] = item
+
+        return sorted(results.values(), key=lambda item: item['rank'])[:num]
 
-        if response and response.get('items'):
-            return response['items']
-        else:
-            return []
-        
     except Exception as e:
         print(f"Error searching Google: {e}")
         return []
     
-def fetch_website_content(url: str) -> str:
+def _fetch_page(url: str, timeout: float | None = None, headers: dict | None = None):
+    return SafeRequest.website_request(
+        url,
+        headers=headers or {},
+        deadline=SafeRequest.deadline_in(min(WEBSITE_DEADLINE, timeout or WEBSITE_DEADLINE)),
+        hedge_after=WEBSITE_HEDGE_AFTER
+    )
+
+def _declared_encoding(response) -> str | None:
+    # Without a declared charset, let the parser sniff it from the document
+    if 'charset' in response.headers.get('content-type', '').lower():
+        return response.encoding
+    return None
+
+def _fetch_text(url: str, timeout: float | None = None) -> str:
+    response = _fetch_page(url, timeout)
+    return get_extraction_service().extract(response.content, _declared_encoding(response))
+
+async def _fetch_source_async(url: str, etag: str | None, last_modified: str | None, timeout: float | None) -> dict:
+    headers = {}
+    if etag:
+        headers['If-None-Match'] = etag
+    if last_modified:
+        headers['If-Modified-Since'] = last_modified
+
+    response = await asyncio.to_thread(_fetch_page, url, timeout, headers)
+    source = {
+        'url': url,
+        'etag': response.headers.get('ETag', etag),
+        'last_modified': response.headers.get('Last-Modified', last_modified),
+        'bytes': len(response.content)
+    }
+    if response.status_code == 304:
+        return {**source, 'status': 'not_modified', 'text': None}
+
+    text = await get_extraction_service().extract_async(response.content, _declared_encoding(response))
+    return {**source, 'status': 'fetched', 'text': text}
+
+def fetch_website_content(url: str, max_chars: int | None = None, timeout: float | None = None) -> str:
     try:
-        response = requests.get(url)
-        soup = bs4.BeautifulSoup(response.text, 'html.parser')
-        
-        # We assume that the JS, footer and header are not relevant to the content
-        for script_or_style in soup(['script', 'style', 'footer', 'header']):
-            script_or_style.decompose()
-        
-        # Get the text content of the body
-        body_text = soup.body.get_text(strip=True)
-        
-        return body_text
+        body_text = shared_call("page", url, _fetch_text, url, timeout)
+        return body_text[:max_chars] if max_chars else body_text
 
     except Exception as e:
         print(f"Error fetching website content: {e}")
         return ""
+
+async def fetch_website_content_async(url: str, max_chars: int | None = None, timeout: float | None = None) -> str:
+    """
+    Same as fetch_website_content, without blocking the event loop:
+    the download runs in a thread and the HTML parsing in the extraction process pool.
+    """
+    source = await fetch_website_source_async(url, timeout=timeout)
+    body_text = source['text'] or ""
+    return body_text[:max_chars] if max_chars else body_text
+
+async def fetch_website_source_async(url: str, etag: str | None = None, last_modified: str | None = None,
+                                     timeout: float | None = None) -> dict:
+    """
+    Fetch a website, conditionally when the validators of a previous fetch are given.
+    Returns the url, status ("fetched", "not_modified" or "error"), text and the new validators.
+    The text is None when the server answered 304 Not Modified.
+    """
+    try:
+        return await shared_call_async("source", (url, etag, last_modified),
+                                       _fetch_source_async, url, etag, last_modified, timeout)
+
+    except Exception as e:
+        print(f"Error fetching website content: {e}")
+        return {'url': url, 'status': 'error', 'text': "", 'etag': etag, 'last_modified': last_modified}
     
 if __name__ == "__main__":
     search_result = search_google("What is the capital of France?")
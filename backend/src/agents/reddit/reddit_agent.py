@@ -2,6 +2,7 @@ import sys
 import os
 import asyncio
 import json
+import uuid
 import logging
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -17,16 +18,19 @@ from google.genai import types
 from reddit_utils import search_subreddits, search_posts_from_subreddits_parallel
 from pydantic import BaseModel
 from google.adk.events import Event
-from typing import AsyncGenerator
-from google.adk.sessions import InMemorySessionService
+from typing import AsyncGenerator, Callable
+from google.adk.models import BaseLlm
 from google.adk.runners import Runner
+from utils.snapshots import SnapshotStore, fingerprint, diff_sources
+from utils.session_store import get_session_service
+from utils.routed_llm import RoutedLlm, routed_model, default_backend
 
 # Contexts refers to the information available yo our agent and its tools during
 # specific operations. It's like a background knowledge and resources needed to
 # perform the task.
 
-SESSION_ID = "reddit_session"
 USER_ID = "reddit_user"
+APP_NAME = "RedditAgent"
 
 class RedditAgent():
     class SummaryOutput(BaseModel):
@@ -43,13 +47,72 @@ class RedditAgent():
     summarizer_instructions: str | None = None
     pros_cons_instructions: str | None = None
 
-    def __init__(self, keywords: list[str]):
+    def __init__(self, keywords: list[str], refresh: bool = False, model_backend: Callable[[str], BaseLlm] | None = None):
         logger.info(f"Initializing RedditAgent with keywords: {keywords}")
         self.keywords = keywords
+        # The models are chosen by the model router, model_backend replaces the real models
+        self.model_backend = model_backend
+        self.routing = []
+        # In refresh mode, only the posts that are new or changed since the previous analysis are analyzed
+        self.snapshot_store = SnapshotStore()
+        self.snapshot_key = ", ".join(sorted(keywords))
+        self.previous = self.snapshot_store.load("reddit", self.snapshot_key) if refresh else None
+        self.refresh_delta = None
+        self.up_to_date = False
+        # Subreddits whose posts could not be fetched this time, None when the search itself failed
+        self.failed_subreddits = []
+
+    def get_posts_to_analyze(self) -> list[dict]:
+        if not self.previous:
+            return self.posts
+
+        previous_posts = self.previous["posts"]
+        self.refresh_delta = diff_sources(
+            {url: post["fingerprint"] for url, post in previous_posts.items()},
+            {url: post["fingerprint"] for url, post in self.get_post_fingerprints().items()}
+        )
+        logger.info("♻️ Refresh: " + ", ".join(f"{len(urls)} {status}" for status, urls in self.refresh_delta.items()))
+
+        delta = set(self.refresh_delta["new"]) | set(self.refresh_delta["changed"])
+        previous_result = self.previous["result"]
+        # A partial previous result is never served as is
+        self.up_to_date = (not delta and not self.refresh_delta["removed"]
+                           and previous_result.get("summary") is not None and previous_result.get("pros_cons") is not None)
+        return [post for post in self.posts if post['url'] in delta]
+
+    def get_post_fingerprints(self) -> dict[str, dict]:
+        # The score moves all the time, only the text tells whether a post changed
+        fingerprints = {
+            post['url']: {'fingerprint': fingerprint(post['title'] + post['content']), 'title': post['title'], 'subreddit': post.get('subreddit')}
+            for post in self.posts
+        }
+        # The posts of a subreddit that failed to load are kept as they were, not counted as removed
+        for url, post in (self.previous or {}).get("posts", {}).items():
+            if url not in fingerprints and self.is_unavailable(post.get("subreddit")):
+                fingerprints[url] = post
+        return fingerprints
+
+    def is_unavailable(self, subreddit: str | None) -> bool:
+        if self.failed_subreddits is None:
+            return True
+        return subreddit is not None and subreddit in self.failed_subreddits
+
+    def get_refresh_instructions(self, previous_output: str) -> str:
+        if not self.previous:
+            return ""
+        removed = [self.previous["posts"][url]["title"] for url in self.refresh_delta["removed"]]
+        return f"""
+        This is a refresh of a previous analysis, here is its output:
+        {json.dumps(self.previous["result"].get(previous_output), indent=4)}
+
+        Update it with the new and changed posts below, and drop the points that only came from these removed posts:
+        {json.dumps(removed, indent=4)}
+        """
 
     async def initialize_agents(self):
         self.posts = await self.get_relevant_posts_from_subreddits_by_keywords(self.keywords)
         logger.info(f"Found {len(self.posts)} total posts from all subreddits")
+        posts_to_analyze = self.get_posts_to_analyze()
 
         summarizer_instructions = f"""
         You are a helpful assistant that summarizes posts from a given subreddit without losing
@@ -57,16 +120,16 @@ class RedditAgent():
         
         Your summary should be human readable and easy to understand, straight to the point.
         You should not include any other information than the summary.
-
+        {self.get_refresh_instructions("summary")}
         Here are the posts to summarize:
-        {json.dumps(self.posts, indent=4)}
+        {json.dumps(posts_to_analyze, indent=4)}
         """
         
         self.summarizer_agent = LlmAgent(
             name="Summarizer",
             description="Summarize the posts",
             tools=[],
-            model="gemini-2.0-flash",
+            model=self.route_model("Summarizer", "gemini-2.0-flash"),
             generate_content_config=types.GenerateContentConfig(
                 temperature=0.3,
             ),
@@ -87,15 +150,16 @@ class RedditAgent():
         You should not include any other information than the summary.
 
         Here is the business idea: {", ".join(self.keywords)}
+        {self.get_refresh_instructions("pros_cons")}
         Here are the posts to analyze:
-        {json.dumps(self.posts, indent=4)}
+        {json.dumps(posts_to_analyze, indent=4)}
         """
         
         self.pros_cons_agent = LlmAgent(
             name="ProsCons",
             description="Analyze the posts and identify the pros and cons",
             tools=[],
-            model="gemini-2.0-flash",
+            model=self.route_model("ProsCons", "gemini-2.0-flash"),
             generate_content_config=types.GenerateContentConfig(
                 temperature=0.3,
             ),
@@ -112,54 +176,112 @@ class RedditAgent():
             sub_agents=[self.summarizer_agent, self.pros_cons_agent],
         )
 
-        self.session_service = InMemorySessionService()
+        # One service for every run of the process, each run in its own session
+        self.session_service = get_session_service()
+        self.session_id = f"reddit_session_{uuid.uuid4().hex}"
         self.session = await self.session_service.create_session(
-            session_id="reddit_session",
-            user_id="reddit_user",
-            app_name="RedditAgent"
+            session_id=self.session_id,
+            user_id=USER_ID,
+            app_name=APP_NAME
         )
 
         self.runner_agent = Runner(
             agent=self.parallel_agent,
-            app_name="RedditAgent",
+            app_name=APP_NAME,
             session_service=self.session_service
         )
 
+    def route_model(self, stage: str, default: str) -> RoutedLlm:
+        return routed_model(stage, default, backend=self.model_backend or default_backend, on_decision=self.routing.append)
+
     async def get_relevant_posts_from_subreddits_by_keywords(self, keywords: list[str], limit: int = 25):
         logger.info(f"Searching for subreddits with keywords: {keywords}, limit: {limit}")
         subreddits = search_subreddits(keywords, limit)
+        if isinstance(subreddits, dict):
+            logger.error(f"Subreddit search failed: {subreddits.get('error')}")
+            self.failed_subreddits = None
+            return []
         logger.info(f"Found {len(subreddits)} relevant subreddits")
         
         logger.info("Fetching posts from all subreddits in parallel...")
-        posts = await search_posts_from_subreddits_parallel(subreddits, limit)
+        self.failed_subreddits = []
+        posts = await search_posts_from_subreddits_parallel(subreddits, limit, self.failed_subreddits)
         
         logger.info(f"Total posts collected: {len(posts)}")
         return posts
 
     async def call_agent_async(self):
+        if self.up_to_date:
+            logger.info("♻️ No post changed since the previous analysis, reusing it")
+            return
+
         final_response = None
         async for event in self.runner_agent.run_async(
-            session_id="reddit_session",
-            user_id="reddit_user",
+            session_id=self.session_id,
+            user_id=USER_ID,
             new_message=types.Content(parts=[types.Part(text="Analyze reddit for business idea.")])
         ):
             print(f"  [Event] Author: {event.author}, Type: {type(event).__name__}, Final: {event.is_final_response()}, Content: {event.content}")
             yield event
+            # Summarizer and ProsCons run in parallel, each gives its own final response
             if event.is_final_response():
                 if event.content and event.content.parts[0].text:
                     final_response = event.content.parts[0].text
                 elif event.actions and event.actions.escalate:
                     final_response = "I'm sorry, I'm not able to analyze the posts. Please try again."
-                break
         
         if final_response:
             print(final_response)
         else:
             print("No final response received")
 
+    async def get_results(self) -> dict:
+        if self.up_to_date:
+            return {**self.previous["result"], "refresh": self.refresh_delta}
+
+        session = await self.session_service.get_session(
+            app_name=APP_NAME,
+            user_id=USER_ID,
+            session_id=self.session_id
+        )
+        return {
+            "summary": session.state.get("summary"),
+            "pros_cons": session.state.get("pros_cons"),
+            "refresh": self.refresh_delta,
+            "routing": self.routing
+        }
+
+    async def save_snapshot(self):
+        results = await self.get_results()
+        # A refresh would reuse a missing output as is
+        if results["summary"] is None or results["pros_cons"] is None:
+            logger.warning("Not saving the analysis snapshot, the summary or the pros and cons are missing")
+            return
+        try:
+            self.snapshot_store.save("reddit", self.snapshot_key, {
+                "keywords": self.keywords,
+                "posts": self.get_post_fingerprints(),
+                "result": {"summary": results["summary"], "pros_cons": results["pros_cons"]}
+            })
+        except OSError as e:
+            logger.warning(f"Could not save the analysis snapshot: {e}")
+
+    async def close_session(self):
+        await self.session_service.delete_session(
+            app_name=APP_NAME,
+            user_id=USER_ID,
+            session_id=self.session_id
+        )
+
     async def run(self):
         await self.initialize_agents()
-        await self.call_agent_async()
+        try:
+            async for _ in self.call_agent_async():
+                pass
+            await self.save_snapshot()
+            return await self.get_results()
+        finally:
+            await self.close_session()
 
 if __name__ == "__main__":
 
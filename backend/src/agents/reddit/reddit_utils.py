@@ -10,6 +10,7 @@ sys.path.append(backend_root)
 import requests
 import json
 from utils.requests import SafeRequest
+from utils.dedup import shared_call
 
 def search_subreddits(keywords: list[str], limit: int = 25):
     url = f"https://www.reddit.com/subreddits/search.json"
@@ -23,7 +24,9 @@ def search_subreddits(keywords: list[str], limit: int = 25):
     }
     
     try:
-        data = SafeRequest.reddit_request(url, params, headers, verbose=True)
+        # Queries of a batch looking up the same keywords share a single request
+        data = shared_call("subreddit_search", (params['q'], limit),
+                           lambda: SafeRequest.reddit_request(url, params, headers, verbose=True))
         subreddits = []
         
         for child in data['data']['children']:
@@ -56,7 +59,8 @@ def search_posts_by_subreddit(subreddit: str, limit: int = 25):
         'User-Agent': 'SubredditSearchBot/1.0'
     }
     try:
-        data = SafeRequest.reddit_request(url, params, headers, verbose=True)
+        data = shared_call("subreddit_posts", (subreddit, limit),
+                           lambda: SafeRequest.reddit_request(url, params, headers, verbose=True))
         posts = []
         
         for child in data['data']['children']:
@@ -66,6 +70,7 @@ def search_posts_by_subreddit(subreddit: str, limit: int = 25):
                 'content': post_data['selftext'],
                 'url': post_data['url'],
                 'score': post_data['score'],
+                'subreddit': subreddit,
             }
             posts.append(post_info)
             
@@ -79,10 +84,15 @@ def search_posts_by_subreddit(subreddit: str, limit: int = 25):
         return {'error': f'Unexpected response format: {str(e)}'}
 
 async def search_posts_by_subreddit_async(subreddit: str, limit: int = 25):
-    loop = asyncio.get_event_loop()
-    return await loop.run_in_executor(None, search_posts_by_subreddit, subreddit, limit)
+    # to_thread keeps the caller's context, and with it the work shared by its batch
+    return await asyncio.to_thread(search_posts_by_subreddit, subreddit, limit)
 
-async def search_posts_from_subreddits_parallel(subreddits: list[dict], limit: int = 25):
+async def search_posts_from_subreddits_parallel(subreddits: list[dict], limit: int = 25,
+                                                failed_subreddits: list[str] | None = None):
+    """
+    Fetch the top posts of every subreddit, in batches of 3.
+    The names of the subreddits that could not be fetched are appended to `failed_subreddits`.
+    """
     start_time = time.time()
     
     batch_size = 3
@@ -100,9 +110,13 @@ async def search_posts_from_subreddits_parallel(subreddits: list[dict], limit: i
             subreddit_name = batch[j]['name']
             if isinstance(result, Exception):
                 print(f"Error fetching posts from r/{subreddit_name}: {result}")
+                if failed_subreddits is not None:
+                    failed_subreddits.append(subreddit_name)
                 continue
             if isinstance(result, dict) and 'error' in result:
                 print(f"Error in response for r/{subreddit_name}: {result['error']}")
+                if failed_subreddits is not None:
+                    failed_subreddits.append(subreddit_name)
                 continue
             all_posts.extend(result)
             success_count += 1
@@ -1,11 +1,31 @@
 from fastapi import FastAPI, Request, Response
-import uvicorn
-from agents.google.google_agent import GoogleAgent
-from fastapi.responses import StreamingResponse
+from fastapi.responses import StreamingResponse, JSONResponse
+from contextlib import asynccontextmanager
+import asyncio
 import json
 import logging
+import os
+import sys
 
-app = FastAPI()
+# Add the root backend directory to the Python path
+backend_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(backend_root)
+
+# The agents pull in the ADK and the Cloud SDKs, they are imported by the
+# endpoints that need them so a cold start only pays for FastAPI
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    from utils.env import getenv
+    from utils.extraction import get_extraction_service
+    # The extraction workers start with the first pages, a cold start does not pay for them.
+    # EXTRACTION_WARM_UP=1 starts them in the background at startup instead, for long-running servers
+    if getenv("EXTRACTION_WARM_UP", "0") == "1":
+        asyncio.get_running_loop().run_in_executor(None, get_extraction_service().warm_up)
+    yield
+    get_extraction_service().shutdown()
+
+app = FastAPI(lifespan=lifespan)
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -18,6 +38,12 @@ def read_root():
 def health_check():
     return {"status": "healthy"}
 
+@app.get("/metrics")
+def metrics():
+    from utils.requests import SafeRequest
+    from utils.model_router import get_model_router
+    return {**SafeRequest.stats(), "models": get_model_router().stats()}
+
 async def event_generator(google_agent):
     try:
         logger.info("Starting event generator")
@@ -49,11 +75,34 @@ async def event_generator(google_agent):
 async def home():
     return {"message": "Hello World"}
 
+def bad_request(message: str) -> JSONResponse:
+    return JSONResponse(status_code=400, content={"message": message})
+
+def parse_time_budget(data: dict) -> float | None:
+    """The time_budget of a request body, in seconds, None when absent."""
+    time_budget = data.get('time_budget')
+    if time_budget is None:
+        return None
+    if isinstance(time_budget, bool) or not isinstance(time_budget, (int, float)) or not time_budget > 0:
+        raise ValueError("time_budget must be a positive number of seconds")
+    return float(time_budget)
+
 @app.post("/search")
 async def search(request: Request):
     try:
+        from agents.google.google_agent import GoogleAgent
         data = await request.json()
-        google_agent = GoogleAgent(query=data['query'])
+        try:
+            time_budget = parse_time_budget(data)
+        except ValueError as e:
+            return bad_request(str(e))
+        # The agent runs its Google search when created, keep it off the event loop
+        google_agent = await asyncio.to_thread(
+            GoogleAgent,
+            query=data['query'],
+            time_budget=time_budget,
+            refresh=data.get('refresh', False)
+        )
         return StreamingResponse(
             event_generator(google_agent),
             media_type="text/event-stream"
@@ -61,6 +110,93 @@ async def search(request: Request):
     except Exception as e:
         return {"message": str(e)}
 
+# Each query of a batch runs its own searches, page fetches and BigQuery jobs
+BATCH_MAX_QUERIES = 20
+BATCH_MAX_CONCURRENCY = 5
+
+async def batch_event_generator(queries: list[str], max_concurrency: int, time_budget: float | None):
+    # Only the GoogleAgent pipeline runs in a batch, its pages, searches and queries are shared.
+    # The Reddit helpers share their requests too, but no RedditAgent runs here yet.
+    from agents.google.google_agent import GoogleAgent
+    from utils.dedup import SharedWork, shared_work_scope
+
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def run_query(index: int, query: str) -> dict:
+        async with semaphore:
+            try:
+                # The agent runs its Google search when created, keep it off the event loop
+                google_agent = await asyncio.to_thread(GoogleAgent, query=query, time_budget=time_budget)
+                await google_agent.initialize_agents()
+                async for event in google_agent.call_agent_async():
+                    logger.info(f"Event received for query {index}: {event.author}")
+                return {"query_index": index, "query": query, "structured_data": google_agent.get_structured_results()}
+            except Exception as e:
+                return {"query_index": index, "query": query, "error": str(e)}
+
+    # Tasks copy the context they are created in, so every query shares the same work
+    with shared_work_scope(SharedWork()) as shared_work:
+        tasks = [asyncio.create_task(run_query(index, query)) for index, query in enumerate(queries)]
+
+    try:
+        for task in asyncio.as_completed(tasks):
+            result = await task
+            data = {
+                "author": "query_results",
+                "content": json.dumps(result),
+                "is_final": False,
+                **result
+            }
+            yield f"data: {json.dumps(data)}\n\n"
+
+        final_data = {
+            "author": "final_results",
+            "content": "",
+            "is_final": True,
+            "shared_work": shared_work.stats()
+        }
+        yield f"data: {json.dumps(final_data)}\n\n"
+    finally:
+        for task in tasks:
+            task.cancel()
+
+@app.post("/search/batch")
+async def search_batch(request: Request):
+    try:
+        data = await request.json()
+        # Checked before the stream starts, once the 200 is sent an error can only be an event
+        queries = data.get('queries')
+        # query_index refers to the client's list, so empty queries are rejected rather than dropped
+        if not isinstance(queries, list) or not all(isinstance(query, str) and query.strip() for query in queries):
+            return bad_request("queries must be a list of non-empty strings")
+        if not 1 <= len(queries) <= BATCH_MAX_QUERIES:
+            return bad_request(f"queries must hold between 1 and {BATCH_MAX_QUERIES} queries")
+        try:
+            max_concurrency = int(data.get('max_concurrency', 3))
+        except (TypeError, ValueError):
+            max_concurrency = 0
+        if not 1 <= max_concurrency <= BATCH_MAX_CONCURRENCY:
+            return bad_request(f"max_concurrency must be an integer between 1 and {BATCH_MAX_CONCURRENCY}")
+        try:
+            time_budget = parse_time_budget(data)
+        except ValueError as e:
+            return bad_request(str(e))
+        return StreamingResponse(
+            batch_event_generator(queries, max_concurrency, time_budget),
+            media_type="text/event-stream"
+        )
+    except Exception as e:
+        return {"message": str(e)}
+
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    import tempfile
+    import uvicorn
+
+    workers = int(os.getenv("WEB_CONCURRENCY", "1"))
+    if workers > 1:
+        # Workers are separate processes, rate limits, quotas and caches go through a shared SQLite file
+        os.environ.setdefault("SHARED_STATE_PATH", os.path.join(tempfile.gettempdir(), "venturescope_state.db"))
+        uvicorn.run("main:app", host="0.0.0.0", port=8000, workers=workers)
+    else:
+        uvicorn.run(app, host="0.0.0.0", port=8000)
 
@@ -0,0 +1,227 @@
+import os
+import re
+import sys
+import json
+import math
+import time
+import tempfile
+import threading
+import logging
+from collections import Counter
+
+backend_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(backend_root)
+
+from utils.env import getenv
+
+logger = logging.getLogger(__name__)
+
+# Metadata snapshot shipped with the repo, used until a refreshed catalog exists
+SNAPSHOT_PATH = os.path.join(backend_root, "data", "bigquery_catalog.json")
+# Where refreshed catalogs are written
+CACHE_PATH = getenv("BIGQUERY_CATALOG_PATH", os.path.join(backend_root, ".cache", "bigquery_catalog.json"))
+# Refresh the metadata of the catalog tables once it is older than this, 0 disables refreshing.
+# With BIGQUERY_CATALOG_DATASETS (comma separated), the refresh lists the tables of those datasets instead.
+MAX_AGE = float(getenv("BIGQUERY_CATALOG_MAX_AGE", str(7 * 24 * 3600)))
+# A failed refresh is not retried before this many seconds
+RETRY_DELAY = 3600.0
+PUBLIC_PROJECT = "bigquery-public-data"
+
+STOPWORDS = {"a", "an", "and", "are", "as", "at", "be", "by", "for", "from", "in", "is", "it", "of", "on", "or", "the", "to", "with"}
+
+def tokenize(text: str) -> list[str]:
+    # Identifiers are split too: "median_income" matches "median income"
+    return [token for token in re.findall(r"[a-z0-9]+", text.lower()) if token not in STOPWORDS]
+
+class BigQueryCatalog:
+    """
+    Index of dataset, table and column metadata with BM25 keyword search,
+    so bigquery_agent writes SQL against tables and columns that exist.
+    """
+    K1 = 1.5
+    B = 0.75
+
+    def __init__(self, tables: list[dict], refreshed_at: float = 0.0):
+        self.tables = tables
+        self.refreshed_at = refreshed_at
+        self._index()
+
+    @classmethod
+    def load(cls, path: str) -> "BigQueryCatalog":
+        with open(path) as f:
+            snapshot = json.load(f)
+        return cls(snapshot["tables"], snapshot.get("refreshed_at", 0.0))
+
+    def save(self, path: str):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump({"refreshed_at": self.refreshed_at, "tables": self.tables}, f, indent=2)
+        os.replace(tmp_path, path)
+
+    def _document(self, table: dict) -> list[str]:
+        # The table and dataset names count twice, they are the strongest signal
+        names = table["table_id"].split(".", 1)[-1]
+        parts = [names, names, table.get("dataset_description", ""), table.get("description", "")]
+        for column in table.get("columns", []):
+            parts.append(column["name"])
+            parts.append(column.get("description", ""))
+        return tokenize(" ".join(parts))
+
+    def _index(self):
+        self._term_frequencies = [Counter(self._document(table)) for table in self.tables]
+        self._lengths = [sum(tf.values()) for tf in self._term_frequencies]
+        self._average_length = sum(self._lengths) / len(self._lengths) if self._lengths else 0.0
+
+        document_frequencies = Counter()
+        for tf in self._term_frequencies:
+            document_frequencies.update(tf.keys())
+        n = len(self.tables)
+        self._idf = {
+            term: math.log(1 + (n - df + 0.5) / (df + 0.5))
+            for term, df in document_frequencies.items()
+        }
+
+    def search(self, query: str, k: int = 5) -> list[dict]:
+        terms = [term for term in tokenize(query) if term in self._idf]
+        if not terms:
+            return []
+
+        scores = []
+        for i, tf in enumerate(self._term_frequencies):
+            norm = self.K1 * (1 - self.B + self.B * self._lengths[i] / self._average_length)
+            score = sum(
+                self._idf[term] * tf[term] * (self.K1 + 1) / (tf[term] + norm)
+                for term in terms if term in tf
+            )
+            if score > 0:
+                scores.append((score, i))
+
+        scores.sort(reverse=True)
+        return [{**self.tables[i], "score": round(score, 3)} for score, i in scores[:k]]
+
+    def is_stale(self, max_age: float = MAX_AGE) -> bool:
+        return max_age > 0 and time.time() - self.refreshed_at > max_age
+
+    @classmethod
+    def fetch(cls, project: str = PUBLIC_PROJECT, datasets: list[str] | None = None,
+              max_tables_per_dataset: int = 50) -> "BigQueryCatalog":
+        """Build a catalog from the BigQuery API metadata of `project`."""
+        from utils.models import get_bigquery_client
+
+        client = get_bigquery_client()
+        tables = []
+        dataset_ids = datasets or [dataset.dataset_id for dataset in client.list_datasets(project)]
+        for dataset_id in dataset_ids:
+            try:
+                dataset = client.get_dataset(f"{project}.{dataset_id}")
+                for i, table_item in enumerate(client.list_tables(dataset)):
+                    if i >= max_tables_per_dataset:
+                        break
+                    tables.append(_table_entry(dataset, client.get_table(table_item.reference)))
+            except Exception as e:
+                logger.warning(f"Skipping dataset {dataset_id}: {e}")
+        return cls(tables, time.time())
+
+    def refreshed(self) -> "BigQueryCatalog":
+        """
+        A catalog of the same tables, with their metadata fetched again from the BigQuery API.
+        A table that cannot be fetched keeps its current metadata.
+        """
+        from utils.models import get_bigquery_client
+
+        client = get_bigquery_client()
+        datasets = {}
+        tables = []
+        for current in self.tables:
+            try:
+                dataset_id = current["table_id"].rsplit(".", 1)[0]
+                if dataset_id not in datasets:
+                    datasets[dataset_id] = client.get_dataset(dataset_id)
+                tables.append(_table_entry(datasets[dataset_id], client.get_table(current["table_id"])))
+            except Exception as e:
+                logger.warning(f"Keeping the previous metadata of {current['table_id']}: {e}")
+                tables.append(current)
+        return BigQueryCatalog(tables, time.time())
+
+def _table_entry(dataset, table) -> dict:
+    return {
+        "table_id": f"{table.project}.{table.dataset_id}.{table.table_id}",
+        "dataset_description": dataset.description or "",
+        "description": table.description or "",
+        "columns": [
+            {"name": field.name, "type": field.field_type, "description": field.description or ""}
+            for field in table.schema
+        ]
+    }
+
+def format_tables(tables: list[dict], max_columns: int = 25) -> str:
+    lines = []
+    for table in tables:
+        columns = ", ".join(f"{column['name']} {column.get('type', '')}".strip() for column in table.get("columns", [])[:max_columns])
+        description = table.get("description") or table.get("dataset_description") or ""
+        lines.append(f"- `{table['table_id']}`: {description}\n  Columns: {columns}")
+    return "\n".join(lines)
+
+_catalog = None
+_catalog_lock = threading.Lock()
+_refreshing = False
+_last_refresh_attempt = 0.0
+
+def _refresh_in_background(current: BigQueryCatalog):
+    global _catalog, _refreshing
+    try:
+        # The shipped tables are curated, a refresh updates them rather than crawling the whole project
+        datasets = getenv("BIGQUERY_CATALOG_DATASETS")
+        catalog = BigQueryCatalog.fetch(datasets=datasets.split(",")) if datasets else current.refreshed()
+        catalog.save(CACHE_PATH)
+        with _catalog_lock:
+            _catalog = catalog
+        logger.info(f"BigQuery catalog refreshed: {len(catalog.tables)} tables")
+    except Exception as e:
+        logger.warning(f"Could not refresh the BigQuery catalog: {e}")
+    finally:
+        _refreshing = False
+
+def get_bigquery_catalog() -> BigQueryCatalog:
+    """
+    The refreshed catalog if there is one, the shipped snapshot otherwise.
+    A stale catalog keeps being served while a fresh one is fetched in the background.
+    """
+    global _catalog, _refreshing, _last_refresh_attempt
+    with _catalog_lock:
+        if _catalog is None:
+            _catalog = BigQueryCatalog.load(CACHE_PATH if os.path.exists(CACHE_PATH) else SNAPSHOT_PATH)
+        if _catalog.is_stale() and not _refreshing and time.time() - _last_refresh_attempt > RETRY_DELAY:
+            _refreshing = True
+            _last_refresh_attempt = time.time()
+            threading.Thread(target=_refresh_in_background, args=(_catalog,), daemon=True).start()
+        return _catalog
+
+def search_bigquery_tables(keywords: str) -> str:
+    """
+    Search the BigQuery public datasets for tables matching the keywords.
+    Returns the best matching tables with their description and columns.
+    """
+    tables = get_bigquery_catalog().search(keywords, k=5)
+    if not tables:
+        return "No matching table found, try other keywords."
+    return format_tables(tables)
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--refresh", action="store_true", help="fetch the catalog from BigQuery")
+    parser.add_argument("--datasets", help="comma separated datasets to fetch, all of them by default")
+    parser.add_argument("--snapshot", help="catalog file to search instead of the default one")
+    parser.add_argument("query", nargs="?", default="")
+    args = parser.parse_args()
+
+    if args.refresh:
+        catalog = BigQueryCatalog.fetch(datasets=args.datasets.split(",") if args.datasets else None)
+        catalog.save(args.snapshot or CACHE_PATH)
+        print(f"Saved {len(catalog.tables)} tables")
+    if args.query:
+        catalog = BigQueryCatalog.load(args.snapshot) if args.snapshot else get_bigquery_catalog()
+        print(format_tables(catalog.search(args.query)))
@@ -0,0 +1,107 @@
+import time
+import math
+
+# Time each stage typically needs to run fully, in seconds
+STAGE_FULL_SECONDS = {
+    "search_agent": 4.0,
+    "fetch_website_agent": 25.0,
+    "bigquery_agent": 25.0,
+    "statista_agent": 5.0,
+}
+
+# Below this allowance bigquery_agent is not worth starting
+BIGQUERY_MIN_SECONDS = 6.0
+# Time kept aside to emit the final structured result
+FINAL_RESULT_RESERVE = 1.0
+DEFAULT_PAGE_CHARS = 20000
+
+class LatencyBudget:
+    """
+    Shares a total time budget across the pipeline stages.
+    Each stage gets the remaining time in proportion to its typical duration, compared
+    to the stages still to run, and degrades when its allowance is below that duration.
+    A budget of None never degrades anything.
+    """
+
+    def __init__(self, seconds: float | None = None, stages: list[str] | None = None):
+        self.seconds = seconds
+        self.deadline = time.monotonic() + seconds if seconds is not None else None
+        self.stages = stages or list(STAGE_FULL_SECONDS)
+        self.stage_deadlines = {}
+        self.degradations = []
+
+    @property
+    def is_limited(self) -> bool:
+        return self.deadline is not None
+
+    def remaining(self) -> float:
+        if not self.is_limited:
+            return math.inf
+        return max(self.deadline - time.monotonic() - FINAL_RESULT_RESERVE, 0.0)
+
+    def stage_allowance(self, stage: str) -> float:
+        if not self.is_limited:
+            return math.inf
+        following = self.stages[self.stages.index(stage):] if stage in self.stages else [stage]
+        expected = sum(STAGE_FULL_SECONDS.get(s, 0.0) for s in following)
+        if expected == 0:
+            return self.remaining()
+        return self.remaining() * STAGE_FULL_SECONDS.get(stage, 0.0) / expected
+
+    def stage_ratio(self, stage: str) -> float:
+        """Fraction of its typical duration the stage can afford, capped to 1."""
+        full = STAGE_FULL_SECONDS.get(stage)
+        if not self.is_limited or not full:
+            return 1.0
+        return min(self.stage_allowance(stage) / full, 1.0)
+
+    def start_stage(self, stage: str) -> float:
+        allowance = self.stage_allowance(stage)
+        if self.is_limited:
+            self.stage_deadlines[stage] = time.monotonic() + allowance
+        return allowance
+
+    def stage_remaining(self, stage: str) -> float:
+        if not self.is_limited:
+            return math.inf
+        if stage not in self.stage_deadlines:
+            return self.stage_allowance(stage)
+        return max(min(self.stage_deadlines[stage] - time.monotonic(), self.remaining()), 0.0)
+
+    def degrade(self, stage: str, action: str, detail: str):
+        self.degradations.append({
+            "stage": stage,
+            "action": action,
+            "detail": detail,
+            "remaining_seconds": round(self.remaining(), 2)
+        })
+
+    def url_count(self, k: int) -> int:
+        ratio = self.stage_ratio("fetch_website_agent")
+        count = max(1, math.floor(k * ratio))
+        if count < k:
+            self.degrade("fetch_website_agent", "reduce_urls", f"fetching {count} URLs instead of {k}")
+        return count
+
+    def page_chars(self, url: str = "") -> int | None:
+        ratio = self.stage_ratio("fetch_website_agent")
+        if ratio >= 1.0:
+            return None
+        chars = max(int(DEFAULT_PAGE_CHARS * ratio), 1000)
+        self.degrade("fetch_website_agent", "trim_page_text", f"{url} trimmed to {chars} characters")
+        return chars
+
+    def should_skip(self, stage: str, min_seconds: float) -> bool:
+        allowance = self.stage_allowance(stage)
+        if allowance < min_seconds:
+            self.degrade(stage, "skip_stage", f"{allowance:.1f}s left, {min_seconds:.1f}s needed")
+            return True
+        return False
+
+    def summary(self) -> dict | None:
+        if not self.is_limited:
+            return None
+        return {
+            "time_budget": self.seconds,
+            "degradations": self.degradations
+        }
@@ -0,0 +1,99 @@
+import asyncio
+import threading
+from collections import Counter
+from concurrent.futures import Future
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Hashable
+
+_current_work = ContextVar("shared_work", default=None)
+
+class SharedWork:
+    """
+    Memoizes the fetches shared by the queries of a batch.
+    The first caller of a key runs the work, concurrent and later callers wait on
+    the same result. Failed work is forgotten so the next caller retries it.
+    Async work runs in a task of its own, so a caller giving up on it does not
+    cancel it for the others.
+    """
+
+    def __init__(self):
+        self._results = {}
+        self._lock = threading.Lock()
+        self.calls = Counter()
+        self.hits = Counter()
+
+    def _claim(self, namespace: str, key: Hashable) -> tuple[Future, bool]:
+        with self._lock:
+            future = self._results.get((namespace, key))
+            if future is not None:
+                self.hits[namespace] += 1
+                return future, False
+            future = Future()
+            self._results[(namespace, key)] = future
+            self.calls[namespace] += 1
+            return future, True
+
+    def _forget(self, namespace: str, key: Hashable):
+        with self._lock:
+            self._results.pop((namespace, key), None)
+
+    def run(self, namespace: str, key: Hashable, fn: Callable, *args) -> Any:
+        future, owner = self._claim(namespace, key)
+        if not owner:
+            return future.result()
+        try:
+            result = fn(*args)
+        except BaseException as e:
+            self._forget(namespace, key)
+            future.set_exception(e)
+            raise
+        future.set_result(result)
+        return result
+
+    async def run_async(self, namespace: str, key: Hashable, fn: Callable, *args) -> Any:
+        with self._lock:
+            task = self._results.get((namespace, key))
+            if task is not None:
+                self.hits[namespace] += 1
+            else:
+                # The work runs in its own task, the first caller does not own it
+                task = asyncio.create_task(self._run_task(namespace, key, fn, *args))
+                self._results[(namespace, key)] = task
+                self.calls[namespace] += 1
+        # A caller cancelled or timed out stops waiting, the work goes on for the others
+        return await asyncio.shield(task)
+
+    async def _run_task(self, namespace: str, key: Hashable, fn: Callable, *args) -> Any:
+        try:
+            return await fn(*args)
+        except BaseException:
+            self._forget(namespace, key)
+            raise
+
+    def stats(self) -> dict:
+        return {
+            namespace: {"executed": self.calls[namespace], "shared": self.hits[namespace]}
+            for namespace in sorted(set(self.calls) | set(self.hits))
+        }
+
+@contextmanager
+def shared_work_scope(work: SharedWork):
+    """Tasks and threads started inside the scope share the work of `work`."""
+    token = _current_work.set(work)
+    try:
+        yield work
+    finally:
+        _current_work.reset(token)
+
+def shared_call(namespace: str, key: Hashable, fn: Callable, *args) -> Any:
+    work = _current_work.get()
+    if work is None:
+        return fn(*args)
+    return work.run(namespace, key, fn, *args)
+
+async def shared_call_async(namespace: str, key: Hashable, fn: Callable, *args) -> Any:
+    work = _current_work.get()
+    if work is None:
+        return await fn(*args)
+    return await work.run_async(namespace, key, fn, *args)
@@ -0,0 +1,18 @@
+import os
+
+_loaded = False
+
+def load_env():
+    """
+    Load the .env file once, on the first code path that reads configuration
+    rather than when a module is imported.
+    """
+    global _loaded
+    if not _loaded:
+        from dotenv import load_dotenv
+        load_dotenv()
+        _loaded = True
+
+def getenv(name: str, default: str | None = None) -> str | None:
+    load_env()
+    return os.getenv(name, default)
@@ -0,0 +1,187 @@
+import os
+import asyncio
+import logging
+import threading
+import multiprocessing
+
+from utils.env import getenv
+
+logger = logging.getLogger(__name__)
+
+# "process" parses pages in a pool of worker processes, "inline" parses them in the calling thread
+EXTRACTION_MODE = getenv("EXTRACTION_MODE", "process")
+EXTRACTION_WORKERS = int(getenv("EXTRACTION_WORKERS", str(min(os.cpu_count() or 1, 4))))
+# Workers are replaced after this many pages, so memory fragmented by large documents is given back
+EXTRACTION_MAX_TASKS_PER_WORKER = int(getenv("EXTRACTION_MAX_TASKS_PER_WORKER", "100"))
+EXTRACTION_TIMEOUT = float(getenv("EXTRACTION_TIMEOUT", "10.0"))
+
+# We assume that the JS, footer and header are not relevant to the content
+IGNORED_TAGS = ['script', 'style', 'footer', 'header']
+
+def extract_text(raw: bytes, encoding: str | None = None, max_chars: int | None = None) -> str:
+    """
+    Parse raw HTML bytes and return the text content of the body.
+    Runs in the worker processes, only the bytes go in and only the text comes back.
+    """
+    import bs4
+
+    soup = bs4.BeautifulSoup(raw, 'html.parser', from_encoding=encoding)
+    for script_or_style in soup(IGNORED_TAGS):
+        script_or_style.decompose()
+
+    if soup.body is None:
+        return ""
+    body_text = soup.body.get_text(strip=True)
+    return body_text[:max_chars] if max_chars else body_text
+
+def _warm_up() -> bool:
+    # Pays the bs4 import and parser setup once per worker instead of on the first page
+    extract_text(b"<html><body><p>warm up</p></body></html>")
+    return True
+
+def _worker_main(conn):
+    _warm_up()
+    while True:
+        try:
+            job = conn.recv()
+        except EOFError:
+            return
+        if job is None:
+            return
+        try:
+            conn.send((True, extract_text(*job)))
+        except Exception as e:
+            conn.send((False, f"{type(e).__name__}: {e}"))
+
+class _Worker:
+    """A worker process and the pipe its pages go through."""
+
+    def __init__(self):
+        self.conn, child_conn = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(target=_worker_main, args=(child_conn,), daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.tasks = 0
+
+    def stop(self):
+        try:
+            self.conn.send(None)
+        except OSError:
+            pass
+        self.conn.close()
+
+    def kill(self):
+        self.process.kill()
+        self.process.join()
+        self.conn.close()
+
+class _WorkerTimedOut(Exception):
+    pass
+
+class _WorkerDied(Exception):
+    pass
+
+class ExtractionService:
+    """
+    Pool of worker processes parsing HTML off the event loop.
+    Each page goes to an idle worker through its own pipe, and its timeout only starts
+    once a worker has it. A page that takes longer than `timeout` gets its worker killed
+    and replaced, the pages of the other workers are not affected. A page whose worker
+    died is tried once more on a new worker.
+    """
+
+    def __init__(self, workers: int = EXTRACTION_WORKERS, max_tasks_per_worker: int = EXTRACTION_MAX_TASKS_PER_WORKER,
+                 timeout: float = EXTRACTION_TIMEOUT, mode: str = EXTRACTION_MODE):
+        self.workers = workers
+        self.max_tasks_per_worker = max_tasks_per_worker
+        self.timeout = timeout
+        self.mode = mode
+        self.restarts = 0
+        self._idle = []
+        self._slots = threading.Semaphore(workers)
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def _acquire(self) -> _Worker:
+        self._slots.acquire()
+        with self._lock:
+            if self._idle:
+                return self._idle.pop()
+        try:
+            return _Worker()
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def _release(self, worker: _Worker, healthy: bool):
+        # Workers are replaced after max_tasks_per_worker pages, or right away when stuck or dead
+        if not healthy:
+            worker.kill()
+            with self._lock:
+                self.restarts += 1
+        elif worker.tasks >= self.max_tasks_per_worker or self._closed:
+            worker.stop()
+        else:
+            with self._lock:
+                self._idle.append(worker)
+        self._slots.release()
+
+    def _run(self, raw: bytes, encoding: str | None, max_chars: int | None) -> str:
+        worker = self._acquire()
+        healthy = False
+        try:
+            worker.conn.send((raw, encoding, max_chars))
+            if not worker.conn.poll(self.timeout):
+                raise _WorkerTimedOut(f"Text extraction timed out after {self.timeout:.1f} seconds")
+            ok, result = worker.conn.recv()
+            healthy = True
+        except (EOFError, OSError) as e:
+            raise _WorkerDied(str(e) or type(e).__name__) from e
+        finally:
+            worker.tasks += 1
+            self._release(worker, healthy)
+        if not ok:
+            raise RuntimeError(result)
+        return result
+
+    def warm_up(self):
+        """Start every worker now rather than on the first pages."""
+        if self.mode != "process":
+            return
+        workers = [self._acquire() for _ in range(self.workers)]
+        for worker in workers:
+            self._release(worker, True)
+
+    def extract(self, raw: bytes, encoding: str | None = None, max_chars: int | None = None) -> str:
+        if self.mode != "process":
+            return extract_text(raw, encoding, max_chars)
+        for attempt in range(2):
+            try:
+                return self._run(raw, encoding, max_chars)
+            except _WorkerTimedOut as e:
+                logger.warning(f"{e}, its worker was replaced")
+                return ""
+            except _WorkerDied:
+                logger.warning("An extraction worker died, retrying the page on a new one")
+        return ""
+
+    async def extract_async(self, raw: bytes, encoding: str | None = None, max_chars: int | None = None) -> str:
+        if self.mode != "process":
+            return extract_text(raw, encoding, max_chars)
+        # The thread only waits on the worker's pipe, the parsing happens in the worker process
+        return await asyncio.to_thread(self.extract, raw, encoding, max_chars)
+
+    def shutdown(self):
+        with self._lock:
+            self._closed = True
+            idle, self._idle = self._idle, []
+        for worker in idle:
+            worker.stop()
+
+_service = None
+
+def get_extraction_service() -> ExtractionService:
+    global _service
+    if _service is None:
+        _service = ExtractionService()
+    return _service
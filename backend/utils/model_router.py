@@ -0,0 +1,198 @@
+import os
+import json
+import math
+import time
+import threading
+from collections import deque
+
+# Candidate models of each stage, in order of preference: the first one is used
+# whenever it meets the targets, the next ones are faster or cheaper fallbacks.
+# MODEL_CANDIDATES can override them with a JSON object of the same shape.
+STAGE_CANDIDATES = {
+    "search_agent": ["gemini-2.0-flash", "gemini-2.0-flash-lite"],
+    "fetch_website_agent": ["gemini-2.0-flash", "gemini-2.0-flash-lite"],
+    "bigquery_agent": ["gemini-1.5-pro", "gemini-2.0-flash"],
+    "statista_agent": ["gemini-2.0-flash", "gemini-2.0-flash-lite"],
+    "Summarizer": ["gemini-2.0-flash", "gemini-2.0-flash-lite"],
+    "ProsCons": ["gemini-2.0-flash", "gemini-2.0-flash-lite"],
+}
+
+# Expected seconds per call before a model has any recorded sample
+PRIOR_LATENCY = {
+    "gemini-1.5-pro": 8.0,
+    "gemini-2.0-flash": 3.0,
+    "gemini-2.0-flash-lite": 2.0,
+}
+DEFAULT_PRIOR_LATENCY = 5.0
+# Model of a stage without candidates
+FALLBACK_MODEL = "gemini-2.0-flash"
+# Relative cost per call, used with a cost target.
+# MODEL_LATENCY_TARGET (seconds) and MODEL_COST_TARGET (relative cost) set the targets
+# of the deployment, for every stage or per stage, see load_target.
+MODEL_COST = {
+    "gemini-1.5-pro": 10.0,
+    "gemini-2.0-flash": 1.0,
+    "gemini-2.0-flash-lite": 0.5,
+}
+DEFAULT_MODEL_COST = 1.0
+
+# Samples kept per model, and samples needed before the error rate is trusted
+WINDOW = int(os.getenv("MODEL_ROUTER_WINDOW", "50"))
+MIN_SAMPLES = 5
+# Above this error rate a model is only used as a last resort
+MAX_ERROR_RATE = float(os.getenv("MODEL_ROUTER_MAX_ERROR_RATE", "0.5"))
+# An unhealthy model is tried again as first choice after this many seconds
+RETRY_UNHEALTHY_AFTER = 60.0
+
+class ModelStats:
+    """Rolling window of the last calls of a model."""
+
+    def __init__(self, window: int = WINDOW):
+        self.samples = deque(maxlen=window)
+        self.last_failure = 0.0
+
+    def record(self, latency: float, ok: bool, output_tokens: int = 0):
+        self.samples.append((latency, ok, output_tokens))
+        if not ok:
+            self.last_failure = time.monotonic()
+
+    @property
+    def calls(self) -> int:
+        return len(self.samples)
+
+    def error_rate(self) -> float:
+        if not self.samples:
+            return 0.0
+        return sum(1 for _, ok, _ in self.samples if not ok) / len(self.samples)
+
+    def latency(self, percentile: float = 0.9) -> float | None:
+        latencies = sorted(latency for latency, ok, _ in self.samples if ok)
+        if not latencies:
+            return None
+        return latencies[min(int(len(latencies) * percentile), len(latencies) - 1)]
+
+    def tokens_per_second(self) -> float | None:
+        successes = [(latency, tokens) for latency, ok, tokens in self.samples if ok and tokens]
+        elapsed = sum(latency for latency, _ in successes)
+        if not elapsed:
+            return None
+        return sum(tokens for _, tokens in successes) / elapsed
+
+    def snapshot(self) -> dict:
+        p50, p90, throughput = self.latency(0.5), self.latency(0.9), self.tokens_per_second()
+        return {
+            "calls": self.calls,
+            "error_rate": round(self.error_rate(), 3),
+            "p50_seconds": round(p50, 3) if p50 is not None else None,
+            "p90_seconds": round(p90, 3) if p90 is not None else None,
+            "tokens_per_second": round(throughput, 1) if throughput is not None else None,
+        }
+
+class ModelRouter:
+    """
+    Picks the model of each stage from its candidates, using what the previous calls of the
+    process measured: latency, error rate and token throughput per model.
+    `choose` returns the candidates in the order to try them, the first one is the choice and
+    the others are the fallbacks used on errors and timeouts.
+    """
+
+    def __init__(self, candidates: dict[str, list[str]] | None = None, window: int = WINDOW,
+                 prior_latency: dict[str, float] | None = None):
+        self.candidates = candidates or load_candidates()
+        self.window = window
+        self.prior_latency = prior_latency or PRIOR_LATENCY
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def _model_stats(self, model: str) -> ModelStats:
+        with self._lock:
+            if model not in self._stats:
+                self._stats[model] = ModelStats(self.window)
+            return self._stats[model]
+
+    def record(self, model: str, latency: float, ok: bool, output_tokens: int = 0):
+        stats = self._model_stats(model)
+        with self._lock:
+            stats.record(latency, ok, output_tokens)
+
+    def expected_latency(self, model: str) -> float:
+        with self._lock:
+            stats = self._stats.get(model)
+            measured = stats.latency(0.9) if stats else None
+        return measured if measured is not None else self.prior_latency.get(model, DEFAULT_PRIOR_LATENCY)
+
+    def is_healthy(self, model: str) -> bool:
+        with self._lock:
+            stats = self._stats.get(model)
+            if stats is None or stats.calls < MIN_SAMPLES:
+                return True
+            # A model shed for its errors gets a new chance once in a while, or it could never recover
+            return stats.error_rate() <= MAX_ERROR_RATE or time.monotonic() - stats.last_failure > RETRY_UNHEALTHY_AFTER
+
+    def choose(self, stage: str, default: str | None = None, latency_target: float | None = None,
+               cost_target: float | None = None) -> tuple[list[str], str]:
+        """
+        Return the candidates of `stage` in the order to try them, and the reason of the choice.
+        With a latency target, the first healthy candidate expected to answer within it is chosen,
+        the fastest one if none is. With a cost target, the candidates above it are dropped unless
+        none is left.
+        """
+        candidates = list(self.candidates.get(stage) or [default or FALLBACK_MODEL])
+        preferred = candidates[0]
+        if cost_target is not None:
+            affordable = [model for model in candidates if MODEL_COST.get(model, DEFAULT_MODEL_COST) <= cost_target]
+            candidates = affordable or [min(candidates, key=lambda model: MODEL_COST.get(model, DEFAULT_MODEL_COST))]
+
+        healthy = [model for model in candidates if self.is_healthy(model)]
+        unhealthy = [model for model in candidates if model not in healthy]
+        reason = "preferred" if candidates[0] == preferred else "cost_target"
+        if not healthy:
+            healthy, unhealthy, reason = candidates, [], "all_unhealthy"
+        elif unhealthy and unhealthy[0] == candidates[0]:
+            reason = "error_rate"
+
+        if latency_target is not None and not math.isinf(latency_target):
+            fitting = [model for model in healthy if self.expected_latency(model) <= latency_target]
+            if fitting and fitting[0] != healthy[0]:
+                reason = "latency_target"
+            elif not fitting:
+                fitting = [min(healthy, key=self.expected_latency)]
+                reason = "fastest"
+            chosen = fitting[0]
+            healthy = [chosen] + [model for model in healthy if model != chosen]
+
+        return healthy + unhealthy, reason
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {model: stats.snapshot() for model, stats in sorted(self._stats.items())}
+
+def load_target(variable: str, stage: str) -> float | None:
+    """
+    The target `variable` sets for `stage`: either a number for every stage, or a JSON object
+    of numbers per stage, e.g. MODEL_LATENCY_TARGET='{"bigquery_agent": 8}'. None when unset.
+    """
+    configured = os.getenv(variable)
+    if not configured:
+        return None
+    target = json.loads(configured)
+    if isinstance(target, dict):
+        target = target.get(stage)
+    return float(target) if target is not None else None
+
+def load_candidates() -> dict[str, list[str]]:
+    configured = os.getenv("MODEL_CANDIDATES")
+    if not configured:
+        return STAGE_CANDIDATES
+    return {**STAGE_CANDIDATES, **json.loads(configured)}
+
+_router = None
+_router_lock = threading.Lock()
+
+def get_model_router() -> ModelRouter:
+    """The router shared by every run of the process, so each run learns from the previous ones."""
+    global _router
+    with _router_lock:
+        if _router is None:
+            _router = ModelRouter()
+        return _router
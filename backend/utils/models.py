@@ -1,5 +1,22 @@
-from google.cloud import language_v1, bigquery
+from concurrent.futures import TimeoutError as QueryTimeoutError
+from functools import cache
+from datetime import date, time
+from decimal import Decimal
+from utils.dedup import shared_call
 import json
+import base64
+
+# The Cloud SDKs are slow to import, they are only loaded when a client is first needed
+
+@cache
+def get_language_client():
+    from google.cloud import language_v1
+    return language_v1.LanguageServiceClient()
+
+@cache
+def get_bigquery_client():
+    from google.cloud import bigquery
+    return bigquery.Client()
 
 def run_sentiment_analysis(text: str) -> tuple[float, float]:
     """
@@ -7,22 +24,44 @@ def run_sentiment_analysis(text: str) -> tuple[float, float]:
     Returns the sentiment score and magnitude.
     The score is a float between -1 and 1, where -1 is very negative and 1 is very positive.
     The magnitude is a float between 0 and infinity, where 0 is no sentiment and higher values indicate stronger sentiment.
+    The backend is chosen with SENTIMENT_BACKEND, see utils.sentiment.
+    """
+    return run_sentiment_analysis_many([text])[0]
+
+def run_sentiment_analysis_many(texts: list[str]) -> list[tuple[float, float]]:
     """
-    try:    
-        client = language_v1.LanguageServiceClient()
-        document = language_v1.Document(content=text, type_=language_v1.Document.Type.PLAIN_TEXT)
-        response = client.analyze_sentiment(request={'document': document})
-        return response.document_sentiment.score, response.document_sentiment.magnitude
-    except Exception as e:
-        print(f"Error running sentiment analysis: {e}")
-        return None, None
-
-def run_bigquery_query(sql_query: str):
+    Run sentiment analysis on several texts at once, in the order given.
+    """
+    from utils.sentiment import get_sentiment_backend
+    return get_sentiment_backend().analyze_many(texts)
+
+def run_bigquery_query(sql_query: str, timeout: float | None = None):
     """
     Run a bigquery query and return the results.
+    With a timeout, the job is cancelled once it runs longer than that many seconds.
     """
-    client = bigquery.Client()
+    # Queries of a batch running the same SQL share a single job
+    return shared_call("bigquery", " ".join(sql_query.split()), _run_bigquery_query, sql_query, timeout)
+
+def _json_value(value):
+    # NUMERIC and BIGNUMERIC columns come back as Decimal, the agent needs them as numbers
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (date, time)):
+        return value.isoformat()
+    if isinstance(value, bytes):
+        return base64.b64encode(value).decode('ascii')
+    return str(value)
+
+def _run_bigquery_query(sql_query: str, timeout: float | None = None):
+    client = get_bigquery_client()
     query_job = client.query(sql_query)
-    query_response = query_job.result().to_dataframe().to_json(orient="records")
+    try:
+        query_result = query_job.result(timeout=timeout)
+    except QueryTimeoutError:
+        query_job.cancel()
+        return json.dumps({"error": f"Query cancelled after {timeout:.1f} seconds, time budget exhausted"})
+    # Rows are serialized directly, going through a DataFrame would import pandas
+    query_response = json.dumps([dict(row.items()) for row in query_result], default=_json_value)
     print(json.dumps(query_response, indent=4))
     return query_response
\ No newline at end of file
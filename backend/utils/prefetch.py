@@ -0,0 +1,98 @@
+import os
+import asyncio
+import logging
+from typing import Awaitable, Callable
+
+logger = logging.getLogger(__name__)
+
+# Candidate pages fetched ahead of the agent, and how many at once
+PREFETCH_URLS = int(os.getenv("PREFETCH_URLS", "10"))
+PREFETCH_CONCURRENCY = int(os.getenv("PREFETCH_CONCURRENCY", "4"))
+# No new prefetch starts once the pages downloaded so far add up to this many bytes
+PREFETCH_MAX_BYTES = int(os.getenv("PREFETCH_MAX_BYTES", str(8 * 1024 * 1024)))
+
+class Prefetcher:
+    """
+    Fetches the likely pages of a run in the background, while the model is still choosing them.
+    A later fetch of the same URL gets the prefetched result, finished or still in flight,
+    and a prefetch still waiting for its turn starts at once.
+    Prefetches nobody asked for are cancelled with `cancel_unused`, a download already running
+    in a thread still completes but its result is dropped.
+    """
+
+    def __init__(self, fetch: Callable[[str], Awaitable[dict]], max_urls: int = PREFETCH_URLS,
+                 max_concurrency: int = PREFETCH_CONCURRENCY, max_bytes: int = PREFETCH_MAX_BYTES):
+        self.fetch = fetch
+        self.max_urls = max_urls
+        self.max_bytes = max_bytes
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._tasks = {}
+        self._fetching = set()
+        self.bytes_fetched = 0
+        self.started = 0
+        self.served = 0
+        self.skipped = 0
+        self.cancelled = 0
+
+    def start(self, urls: list[str]):
+        """Start prefetching `urls`, most likely first."""
+        for url in urls:
+            if self.started >= self.max_urls:
+                break
+            if url and url not in self._tasks:
+                self._tasks[url] = asyncio.create_task(self._prefetch(url))
+                self.started += 1
+
+    async def _prefetch(self, url: str) -> dict | None:
+        async with self._semaphore:
+            if self.bytes_fetched >= self.max_bytes:
+                self.skipped += 1
+                return None
+            return await self._fetch(url)
+
+    async def _fetch(self, url: str) -> dict:
+        self._fetching.add(url)
+        source = await self.fetch(url)
+        self.bytes_fetched += source.get('bytes', 0)
+        return source
+
+    async def get(self, url: str) -> dict | None:
+        """The prefetched result of `url`, None when it was not prefetched."""
+        task = self._tasks.get(url)
+        if task is None:
+            return None
+        if not task.done() and url not in self._fetching:
+            # Still queued behind the other prefetches, the agent needs it now
+            task.cancel()
+            task = self._tasks[url] = asyncio.create_task(self._fetch(url))
+        # A caller giving up, on its stage budget for instance, does not cancel the download:
+        # it can be shared with the other queries of a batch, or cancelled with cancel_unused
+        try:
+            source = await asyncio.shield(task)
+        except asyncio.CancelledError:
+            # The prefetch was cancelled, not the caller
+            if not task.cancelled():
+                raise
+            source = None
+        finally:
+            if task.done() and self._tasks.get(url) is task:
+                del self._tasks[url]
+        if source is not None:
+            self.served += 1
+        return source
+
+    def cancel_unused(self):
+        for task in self._tasks.values():
+            if not task.done():
+                task.cancel()
+                self.cancelled += 1
+        self._tasks.clear()
+
+    def stats(self) -> dict:
+        return {
+            "started": self.started,
+            "served": self.served,
+            "cancelled": self.cancelled,
+            "skipped_over_budget": self.skipped,
+            "bytes_fetched": self.bytes_fetched
+        }
@@ -2,86 +2,310 @@ import requests as req
 import time
 import json
 import random
+import threading
+from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlparse
+from utils.shared_state import get_shared_state
+
+DEFAULT_DEADLINE = 60.0 # Total time a request may spend, retries and backoff included
+DEFAULT_TIMEOUT = 15.0 # Time a single attempt may take
+
+# Status codes worth retrying, everything else in 4xx is the caller's fault
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+class CircuitOpenError(req.exceptions.RequestException):
+    # Attempts sent before the request was given up, 0 when nothing reached the host
+    attempts = 0
+
+class DeadlineExceededError(req.exceptions.RequestException):
+    attempts = 0
+
+class CircuitBreaker:
+    """
+    Per-host circuit breaker.
+    closed: requests go through, consecutive failures are counted.
+    open: requests are shed until `recovery_timeout` seconds have passed.
+    half_open: a single probe request is let through, its outcome closes or re-opens the circuit.
+    """
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int = 5, recovery_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.state = CircuitBreaker.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.shed_count = 0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow_request(self) -> bool:
+        with self._lock:
+            if self.state == CircuitBreaker.OPEN and time.monotonic() - self.opened_at >= self.recovery_timeout:
+                self.state = CircuitBreaker.HALF_OPEN
+                self._probe_in_flight = False
+
+            if self.state == CircuitBreaker.CLOSED:
+                return True
+            if self.state == CircuitBreaker.HALF_OPEN and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return True
+
+            self.shed_count += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = CircuitBreaker.CLOSED
+            self.failures = 0
+            self._probe_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == CircuitBreaker.HALF_OPEN or self.failures >= self.failure_threshold:
+                self.state = CircuitBreaker.OPEN
+                self.opened_at = time.monotonic()
+            self._probe_in_flight = False
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "state": self.state,
+                "failures": self.failures,
+                "shed_requests": self.shed_count
+            }
 
 class SafeRequest:
-    # Class-level variables for rate limiting
-    _count_reddit = 0
-    _start_time_reddit = time.time()
-    _last_request_time = 0
+    # Rate limits, quota counters and caches live in the shared state, so they hold
+    # across every worker process. Circuit breakers stay per process.
+    _reddit_min_delay = 5.0
+
+    _google_limit = 99 # Google API limits are 100 requests per day
+    _google_cache_ttl = 24 * 3600
+
+    _breakers = {}
+    _lock_breakers = threading.Lock()
+    _count_hedged = 0
+    _lock_hedged = threading.Lock()
+    _hedge_executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix="hedge")
 
-    _count_google = 0 # Google API limits are 100 requests per day
+    @staticmethod
+    def deadline_in(seconds: float) -> float:
+        return time.monotonic() + seconds
+
+    @staticmethod
+    def _breaker(url: str) -> CircuitBreaker:
+        host = urlparse(url).netloc
+        with SafeRequest._lock_breakers:
+            if host not in SafeRequest._breakers:
+                SafeRequest._breakers[host] = CircuitBreaker()
+            return SafeRequest._breakers[host]
+
+    @staticmethod
+    def stats() -> dict:
+        with SafeRequest._lock_breakers:
+            breakers = dict(SafeRequest._breakers)
+        return {
+            "breakers": {host: breaker.snapshot() for host, breaker in breakers.items()},
+            "shed_requests": sum(breaker.shed_count for breaker in breakers.values()),
+            "hedged_requests": SafeRequest._count_hedged,
+            "google_quota_remaining": SafeRequest.google_quota_remaining()
+        }
+
+    @staticmethod
+    def _retry_after(response: req.Response | None) -> float | None:
+        if response is None or not response.headers.get('Retry-After'):
+            return None
+        value = response.headers['Retry-After']
+        try:
+            return max(float(value), 0.0)
+        except ValueError:
+            pass
+        try:
+            return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+        except (TypeError, ValueError):
+            return None
+
+    @staticmethod
+    def _backoff(attempt: int, response: req.Response | None) -> float:
+        retry_after = SafeRequest._retry_after(response)
+        if retry_after is not None:
+            return retry_after
+        if response is not None and response.status_code == 429:
+            return (2 ** attempt) * 60 + random.uniform(0, 30)
+        return 2 ** attempt + random.uniform(0, 1)
 
     @staticmethod
     def __request(url: str, method: str = 'GET', params: dict = {}, headers: dict = {}, 
-                data: dict = {}, retries: int = 3, verbose: bool = False) -> dict:
+                data: dict = {}, retries: int = 3, verbose: bool = False,
+                deadline: float | None = None, timeout: float = DEFAULT_TIMEOUT,
+                as_json: bool = True):
+        deadline = deadline if deadline is not None else SafeRequest.deadline_in(DEFAULT_DEADLINE)
+        breaker = SafeRequest._breaker(url)
+
         for attempt in range(retries):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                error = DeadlineExceededError(f"Deadline exceeded for {url} after {attempt} attempts")
+                error.attempts = attempt
+                raise error
+            if not breaker.allow_request():
+                error = CircuitOpenError(f"Circuit open for {urlparse(url).netloc}, request shed")
+                error.attempts = attempt
+                raise error
+
+            response = None
             try:
-                response = req.request(method, url, params=params, headers=headers, data=data)
+                response = req.request(method, url, params=params, headers=headers, data=data,
+                                       timeout=min(timeout, remaining))
                 response.raise_for_status()
-                response_data = response.json() 
+                response_data = response.json() if as_json else response
+                breaker.record_success()
                 if verbose:
                     print(f"Request successful for {url}")
                 return response_data
             except req.exceptions.RequestException as e:
-                if hasattr(e, 'response') and e.response and e.response.status_code == 429:
-                    wait_time = (2 ** attempt) * 60 + random.uniform(0, 30)
-                    if verbose:
-                        print(f"Rate limited (429), waiting {wait_time:.2f} seconds before retry {attempt + 1}/{retries}")
-                    time.sleep(wait_time)
-                elif attempt == retries - 1:
+                response = getattr(e, 'response', None)
+                if response is not None and response.status_code not in RETRYABLE_STATUS:
+                    # The host answered, it is the request that is wrong
+                    breaker.record_success()
+                    raise e
+                breaker.record_failure()
+
+                if attempt == retries - 1:
                     raise e
-                else:
-                    time.sleep(2 ** attempt)
+
+                wait_time = SafeRequest._backoff(attempt, response)
+                if time.monotonic() + wait_time >= deadline:
+                    error = DeadlineExceededError(f"Deadline exceeded for {url}, next retry would wait {wait_time:.2f} seconds")
+                    error.attempts = attempt + 1
+                    raise error from e
+                if verbose:
+                    status = response.status_code if response is not None else type(e).__name__
+                    print(f"Request failed ({status}), waiting {wait_time:.2f} seconds before retry {attempt + 1}/{retries}")
+                time.sleep(wait_time)
                     
         raise req.exceptions.RequestException(f"Failed to fetch data from {url} after {retries} attempts")
 
+    @staticmethod
+    def website_request(url: str, headers: dict = {}, retries: int = 2, verbose: bool = False,
+                        deadline: float | None = None, timeout: float = DEFAULT_TIMEOUT,
+                        hedge_after: float | None = None, max_hedges: int = 1) -> req.Response:
+        """
+        Fetch a web page and return the raw response.
+        With `hedge_after`, a duplicate request is sent when the first one has not answered
+        after that many seconds, and the first response to come back wins.
+        """
+        def attempt():
+            return SafeRequest.__request(url, 'GET', {}, headers, {}, retries, verbose,
+                                         deadline, timeout, as_json=False)
+
+        if hedge_after is None:
+            return attempt()
+
+        futures = [SafeRequest._hedge_executor.submit(attempt)]
+        error = None
+        while futures:
+            can_hedge = len(futures) <= max_hedges and error is None
+            done, pending = wait(futures, timeout=hedge_after if can_hedge else None,
+                                 return_when=FIRST_COMPLETED)
+            if not done:
+                with SafeRequest._lock_hedged:
+                    SafeRequest._count_hedged += 1
+                if verbose:
+                    print(f"No response from {url} after {hedge_after:.2f} seconds, hedging")
+                futures.append(SafeRequest._hedge_executor.submit(attempt))
+                continue
+
+            for future in done:
+                if future.exception() is None:
+                    for other in pending:
+                        other.cancel()
+                    return future.result()
+                error = future.exception()
+            futures = list(pending)
+
+        raise error
+
     @staticmethod
     def reddit_request(url: str, params: dict = {}, headers: dict = {}, 
-                    data: dict = {}, retries: int = 5, verbose: bool = False) -> dict:
+                    data: dict = {}, retries: int = 5, verbose: bool = False,
+                    deadline: float | None = None) -> dict:
         try:
-            current_time = time.time()
-            
-            if SafeRequest._last_request_time > 0:
-                time_since_last = current_time - SafeRequest._last_request_time
-                min_delay = 5.0
-                if time_since_last < min_delay:
-                    sleep_time = min_delay - time_since_last + random.uniform(1, 3)
-                    if verbose:
-                        print(f"Rate limiting: waiting {sleep_time:.2f} seconds between requests")
-                    time.sleep(sleep_time)
-            
-            if current_time - SafeRequest._start_time_reddit >= 60:
-                SafeRequest._count_reddit = 0
-                SafeRequest._start_time_reddit = current_time
-            
-            SafeRequest._count_reddit += 1
-            if SafeRequest._count_reddit >= 10:
-                wait_time = 60 - (current_time - SafeRequest._start_time_reddit) + random.uniform(10, 20)
-                if wait_time > 0:
-                    if verbose:
-                        print(f"Conservative rate limit reached, waiting {wait_time:.2f} seconds...")
-                    time.sleep(wait_time)
-                SafeRequest._count_reddit = 0
-                SafeRequest._start_time_reddit = time.time()
+            # The deadline also covers the time spent waiting on the rate limiter
+            deadline = deadline if deadline is not None else SafeRequest.deadline_in(DEFAULT_DEADLINE * 2)
+
+            # Every request reserves its own start time at least 6 seconds after the previous one,
+            # across all workers, which also keeps us under 10 requests per minute
+            interval = SafeRequest._reddit_min_delay + random.uniform(1, 3)
+            sleep_time = get_shared_state().reserve_slot("reddit:next_request", interval)
+            if time.monotonic() + sleep_time >= deadline:
+                raise DeadlineExceededError(f"Deadline exceeded for {url}, rate limiter would wait {sleep_time:.2f} seconds")
+            if sleep_time > 0:
+                if verbose:
+                    print(f"Rate limiting: waiting {sleep_time:.2f} seconds between requests")
+                time.sleep(sleep_time)
 
             headers['User-Agent'] = 'SubredditSearchBot/1.0'
-            SafeRequest._last_request_time = time.time()
-            return SafeRequest.__request(url, 'GET', params, headers, data, retries, verbose)
+            return SafeRequest.__request(url, 'GET', params, headers, data, retries, verbose, deadline)
             
         except req.exceptions.RequestException as e:
             if verbose:
                 print(f"Request failed: {e}")
             raise e
         
+    @staticmethod
+    def _google_quota_key() -> str:
+        # The quota is daily, one counter per day
+        return f"google:requests:{datetime.now(timezone.utc).date().isoformat()}"
+
+    @staticmethod
+    def google_quota_remaining() -> int:
+        used = get_shared_state().count(SafeRequest._google_quota_key())
+        return max(SafeRequest._google_limit - used, 0)
+
+    @staticmethod
+    def _google_cache_key(url: str, params: dict) -> str:
+        # The API key does not change the response, keep it out of the cache key
+        return 'google:cache:' + url + '?' + json.dumps({k: v for k, v in params.items() if k != 'key'}, sort_keys=True)
+
+    @staticmethod
+    def is_google_cached(url: str, params: dict) -> bool:
+        return get_shared_state().cache_has(SafeRequest._google_cache_key(url, params))
+
     @staticmethod
     def google_request(url: str, params: dict = {}, headers: dict = {}, 
-                    data: dict = {}, retries: int = 5, verbose: bool = False) -> dict:
+                    data: dict = {}, retries: int = 5, verbose: bool = False,
+                    use_cache: bool = True, deadline: float | None = None) -> dict:
         try:
-            if SafeRequest._count_google >= 99:
+            state = get_shared_state()
+            cache_key = SafeRequest._google_cache_key(url, params)
+            cached = state.cache_get(cache_key) if use_cache else None
+            if cached is not None:
+                if verbose:
+                    print(f"Cache hit for {cache_key}")
+                return cached
+
+            # Counting has to be atomic, search pages are fetched from several threads and workers
+            quota_key = SafeRequest._google_quota_key()
+            if not state.incr_below(quota_key, SafeRequest._google_limit):
                 raise req.exceptions.RequestException("Google API limit reached")
-            
-            SafeRequest._count_google += 1
-            return SafeRequest.__request(url, 'GET', params, headers, data, retries, verbose)
+
+            try:
+                response = SafeRequest.__request(url, 'GET', params, headers, data, retries, verbose, deadline)
+            except (CircuitOpenError, DeadlineExceededError) as e:
+                # Shed before anything was sent, the call did not use the quota
+                if e.attempts == 0:
+                    state.decr(quota_key)
+                raise
+            if use_cache:
+                state.cache_set(cache_key, response, ttl=SafeRequest._google_cache_ttl)
+            return response
         except req.exceptions.RequestException as e:
             if verbose:
                 print(f"Request failed: {e}")
@@ -0,0 +1,134 @@
+import os
+import math
+import time
+import asyncio
+import logging
+from functools import cache
+from typing import AsyncGenerator, Callable
+
+from google.adk.models import BaseLlm, LlmRequest, LlmResponse
+from google.adk.models.registry import LLMRegistry
+from pydantic import Field, PrivateAttr
+
+from utils.model_router import ModelRouter, get_model_router, load_target
+
+logger = logging.getLogger(__name__)
+
+# A candidate that has not started answering after this many seconds is given up for the next one
+MODEL_TIMEOUT = float(os.getenv("MODEL_TIMEOUT", "30"))
+
+@cache
+def default_backend(model: str) -> BaseLlm:
+    # One client per model for the whole process
+    return LLMRegistry.new_llm(model)
+
+class RoutedLlm(BaseLlm):
+    """
+    Model of an agent stage, chosen for each call by the model router.
+    The call goes to the router's first choice, and falls back to the next candidate when
+    a model fails or times out before its first response. Once a model started answering,
+    its errors are not retried. `backend` builds the model of a name, it can be replaced
+    by a scripted fake to run the pipeline without any model behind it.
+    """
+    stage: str
+    router: ModelRouter = Field(default_factory=get_model_router)
+    backend: Callable[[str], BaseLlm] = default_backend
+    # Seconds the stage can still spend, read at each call
+    latency_target: Callable[[], float | None] | None = None
+    cost_target: float | None = None
+    timeout: float = MODEL_TIMEOUT
+    # Receives a dict describing each routing decision
+    on_decision: Callable[[dict], None] | None = None
+
+    _calls: int = PrivateAttr(default=0)
+
+    @property
+    def capabilities(self):
+        return self.backend(self.model).capabilities
+
+    async def generate_content_async(self, llm_request: LlmRequest, stream: bool = False) -> AsyncGenerator[LlmResponse, None]:
+        target = self.latency_target() if self.latency_target else None
+        candidates, reason = self.router.choose(self.stage, default=self.model, latency_target=target, cost_target=self.cost_target)
+        decision = {
+            "stage": self.stage,
+            "call": self._calls,
+            "model": None,
+            "preferred": (self.router.candidates.get(self.stage) or [self.model])[0],
+            "reason": reason,
+            "candidates": candidates,
+            "target_seconds": round(target, 2) if target is not None else None,
+            "fallbacks": []
+        }
+        self._calls += 1
+
+        for model in candidates:
+            llm_request.model = model
+            responses = self.backend(model).generate_content_async(llm_request, stream=stream)
+            start = time.monotonic()
+            try:
+                first = await asyncio.wait_for(anext(responses), timeout=self.timeout)
+                if first.error_code and not first.content:
+                    raise RuntimeError(f"{first.error_code}: {first.error_message}")
+            except StopAsyncIteration:
+                error = "no response"
+            except asyncio.TimeoutError:
+                error = f"no response after {self.timeout:g}s"
+            except Exception as e:
+                error = str(e) or type(e).__name__
+            else:
+                decision["model"] = model
+                self._report(decision)
+                output_tokens = 0
+                try:
+                    response = first
+                    while True:
+                        if response.usage_metadata and response.usage_metadata.candidates_token_count:
+                            output_tokens = response.usage_metadata.candidates_token_count
+                        yield response
+                        try:
+                            response = await anext(responses)
+                        except StopAsyncIteration:
+                            break
+                except GeneratorExit:
+                    # The consumer stopped early with what it needed, like GoogleAgent on the final event
+                    self._record_success(decision, model, start, output_tokens)
+                    await responses.aclose()
+                    raise
+                except Exception:
+                    self.router.record(model, time.monotonic() - start, ok=False)
+                    raise
+                self._record_success(decision, model, start, output_tokens)
+                return
+
+            await responses.aclose()
+            self.router.record(model, time.monotonic() - start, ok=False)
+            decision["fallbacks"].append({"model": model, "error": error[:200]})
+            logger.warning(f"🔀 {self.stage}: {model} failed ({error[:200]}), falling back")
+
+        self._report(decision)
+        raise RuntimeError(f"Every candidate model of {self.stage} failed: {decision['fallbacks']}")
+
+    def _record_success(self, decision: dict, model: str, start: float, output_tokens: int):
+        latency = time.monotonic() - start
+        self.router.record(model, latency, ok=True, output_tokens=output_tokens)
+        decision["latency_seconds"] = round(latency, 3)
+
+    def _report(self, decision: dict):
+        if self.on_decision:
+            self.on_decision(decision)
+
+def routed_model(stage: str, default: str, latency_target: Callable[[], float | None] | None = None,
+                 cost_target: float | None = None, **kwargs) -> RoutedLlm:
+    """
+    The routed model of a stage, `default` is used when the stage has no configured candidates.
+    The targets configured with MODEL_LATENCY_TARGET and MODEL_COST_TARGET also apply,
+    the tighter one wins when the caller gives its own.
+    """
+    configured_latency = load_target("MODEL_LATENCY_TARGET", stage)
+    if configured_latency is not None:
+        caller_latency = latency_target
+        latency_target = lambda: min(configured_latency, caller_latency() if caller_latency else math.inf)
+    configured_cost = load_target("MODEL_COST_TARGET", stage)
+    if configured_cost is not None:
+        cost_target = min(configured_cost, cost_target) if cost_target is not None else configured_cost
+    return RoutedLlm(model=default, stage=stage, latency_target=latency_target, cost_target=cost_target, **kwargs)
@@ -0,0 +1,250 @@
+import os
+import logging
+import threading
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# "local" scores texts with the lexicon engine in-process, "cloud" calls the Cloud Natural
+# Language API and needs credentials. Cloud NL is only used when explicitly configured.
+SENTIMENT_BACKEND = os.getenv("SENTIMENT_BACKEND", "local")
+# Optional lexicon file, one "word<TAB>valence" per line with valences between -4 and 4
+# (the VADER lexicon format). Replaces the built-in lexicon.
+SENTIMENT_LEXICON = os.getenv("SENTIMENT_LEXICON")
+SENTIMENT_CLOUD_WORKERS = int(os.getenv("SENTIMENT_CLOUD_WORKERS", "8"))
+
+# Valences between -4 and 4, tuned for market and product content
+LEXICON = {
+    # Positive
+    "good": 1.9, "great": 3.1, "excellent": 3.2, "amazing": 2.8, "awesome": 3.1, "best": 3.2,
+    "better": 1.9, "love": 3.2, "loved": 2.9, "like": 1.5, "liked": 1.8, "enjoy": 2.2, "happy": 2.7,
+    "nice": 1.8, "useful": 1.9, "helpful": 1.8, "easy": 1.9, "reliable": 1.9, "recommend": 1.5,
+    "recommended": 1.8, "worth": 0.9, "valuable": 2.1, "success": 2.7, "successful": 2.8,
+    "profitable": 1.9, "profit": 1.8, "profits": 1.8, "growth": 1.6, "growing": 1.5, "grow": 1.3,
+    "gain": 1.8, "gains": 1.8, "boom": 1.9, "booming": 2.0, "thriving": 2.4, "opportunity": 1.9,
+    "opportunities": 1.9, "promising": 1.9, "innovative": 1.9, "innovation": 1.6, "strong": 2.3,
+    "demand": 0.6, "popular": 1.8, "leading": 1.4, "win": 2.8, "winning": 2.4, "benefit": 2.0,
+    "benefits": 1.6, "improve": 1.9, "improved": 2.1, "improvement": 2.0, "efficient": 1.8,
+    "affordable": 1.5, "satisfied": 1.8, "satisfaction": 1.9, "positive": 2.3, "optimistic": 1.9,
+    "impressive": 2.3, "perfect": 2.7, "fantastic": 2.6, "wonderful": 2.7, "outstanding": 3.0,
+    "robust": 1.4, "resilient": 1.6, "lucrative": 2.2, "attractive": 1.9, "advantage": 1.0,
+    "rising": 0.9, "exceed": 1.4, "exceeded": 1.4, "record": 0.6, "secure": 1.4, "safe": 1.9,
+    "fun": 2.3, "cool": 1.3, "glad": 2.0, "thanks": 1.9, "interesting": 1.7, "solid": 1.3,
+    # Negative
+    "bad": -2.5, "worse": -2.1, "worst": -3.1, "terrible": -2.1, "awful": -2.0, "horrible": -2.5,
+    "poor": -2.1, "hate": -2.7, "hated": -3.2, "dislike": -1.6, "disappointed": -1.9,
+    "disappointing": -2.2, "useless": -1.8, "difficult": -1.5, "hard": -0.4, "expensive": -0.9,
+    "overpriced": -1.9, "costly": -1.2, "risk": -1.1, "risks": -1.1, "risky": -1.4, "fail": -2.5,
+    "failed": -2.3, "failure": -2.3, "failing": -2.3, "loss": -1.3, "losses": -1.7, "lose": -1.7,
+    "losing": -1.6, "decline": -1.5, "declining": -1.5, "drop": -1.1, "dropped": -1.2, "fall": -0.8,
+    "falling": -1.0, "weak": -1.9, "crisis": -3.1, "recession": -2.1, "debt": -1.5, "bankrupt": -2.6,
+    "bankruptcy": -2.6, "problem": -1.7, "problems": -1.7, "issue": -0.8, "issues": -0.8,
+    "broken": -2.1, "scam": -2.7, "fraud": -2.8, "saturated": -1.2, "competitive": -0.3,
+    "struggle": -2.0, "struggling": -2.1, "slow": -1.0, "unreliable": -1.9, "concern": -1.3,
+    "concerns": -1.3, "worried": -1.8, "negative": -2.7, "pessimistic": -1.9, "complaint": -1.9,
+    "complaints": -1.7, "avoid": -1.2, "waste": -1.8, "wasted": -2.2, "annoying": -1.7,
+    "frustrating": -1.9, "angry": -2.3, "sad": -2.1, "unfortunately": -1.6, "shortage": -1.4,
+    "layoffs": -2.0, "lawsuit": -1.7, "ban": -2.6, "banned": -2.0, "dead": -3.3, "dying": -2.9,
+}
+# Words flipping the valence of the one to three words after them
+NEGATIONS = {"not", "no", "never", "none", "nobody", "nothing", "neither", "nor", "without",
+             "cannot", "dont", "doesnt", "didnt", "isnt", "wasnt", "arent", "werent", "wont",
+             "wouldnt", "shouldnt", "couldnt", "cant", "hardly", "barely"}
+# Words strengthening or weakening the valence of the next word
+BOOSTERS = {"very": 0.293, "really": 0.293, "extremely": 0.293, "highly": 0.293, "incredibly": 0.293,
+            "super": 0.293, "so": 0.293, "most": 0.293, "totally": 0.293, "absolutely": 0.293,
+            "slightly": -0.293, "somewhat": -0.293, "kinda": -0.293, "little": -0.293}
+
+NEGATION_SCALAR = -0.74
+NEGATION_WINDOW = 3
+# Normalization of a sentence's summed valence into [-1, 1]: x / sqrt(x^2 + ALPHA)
+ALPHA = 15.0
+
+DOCUMENT_SEPARATOR = "\x00"
+SEPARATOR_BYTE = 0
+# Bytes ending a sentence
+BOUNDARY_BYTES = b".!?\n"
+HASH_BASE = np.uint64(1099511628211)
+
+class SentimentBackend(ABC):
+    """
+    Scores texts with the semantics of the Cloud Natural Language API:
+    the score is between -1 (negative) and 1 (positive), the magnitude is the total
+    strength of the emotion, between 0 and infinity, and grows with the length of the text.
+    """
+    name = "base"
+
+    @abstractmethod
+    def analyze_many(self, texts: list[str]) -> list[tuple[float, float]]:
+        """The (score, magnitude) of each text, in the order given."""
+
+    def analyze(self, text: str) -> tuple[float, float]:
+        return self.analyze_many([text])[0]
+
+def _tokenize(data: np.ndarray) -> dict[str, np.ndarray]:
+    """
+    Split lowercased UTF-8 bytes into words, without leaving NumPy: a word is a run of
+    letters (non-ASCII bytes included), identified by a 64-bit polynomial hash of its bytes.
+    Returns the hash, sentence and document of each word, and the number of sentences.
+    """
+    is_letter = ((data >= ord("a")) & (data <= ord("z"))) | (data >= 0x80)
+    is_boundary = data == SEPARATOR_BYTE
+    for boundary in BOUNDARY_BYTES:
+        is_boundary |= data == boundary
+
+    # Running sums over every byte are the slow part, positions are searched instead
+    edges = np.flatnonzero(np.diff(is_letter.view(np.int8), prepend=0, append=0))
+    starts, ends = edges[::2], edges[1::2]
+    lengths = ends - starts
+
+    # Position of every letter inside its word, then hash = sum(byte * P^position), wrapping at 2^64
+    offsets = np.cumsum(lengths) - lengths
+    positions = np.arange(lengths.sum()) - np.repeat(offsets, lengths)
+    powers = np.ones(max(lengths.max(initial=0), 1), dtype=np.uint64)
+    powers[1:] = np.cumprod(np.full(len(powers) - 1, HASH_BASE, dtype=np.uint64))
+    contributions = data[is_letter].astype(np.uint64) * powers[positions]
+    hashes = np.add.reduceat(contributions, offsets) if len(starts) else np.zeros(0, dtype=np.uint64)
+
+    boundaries = np.flatnonzero(is_boundary)
+    separators = np.flatnonzero(data == SEPARATOR_BYTE)
+    return {
+        "hashes": hashes,
+        "sentences": np.searchsorted(boundaries, starts),
+        "documents": np.searchsorted(separators, starts) - 1,
+        "sentence_count": len(boundaries) + 1,
+    }
+
+def _encode(texts: list[str]) -> np.ndarray:
+    # Apostrophes are dropped so "isn't" reads as the negation "isnt".
+    # Each document starts with a separator byte, so document i owns the words after separator i
+    joined = "".join(DOCUMENT_SEPARATOR + text.replace(DOCUMENT_SEPARATOR, " ") for text in texts)
+    joined = joined.lower().replace("'", "").replace("\u2019", "")
+    return np.frombuffer(joined.encode("utf-8"), dtype=np.uint8)
+
+class LexiconSentiment(SentimentBackend):
+    """
+    Lexicon and rule based engine in the spirit of VADER, without any network call.
+    All the documents of a call are scored in one pass: tokenization, lexicon lookups,
+    negations, boosters and per-sentence aggregations are NumPy array operations over
+    the bytes and words of every document at once.
+    """
+    name = "local"
+
+    def __init__(self, lexicon: dict[str, float] | None = None):
+        lexicon = {**(lexicon or LEXICON)}
+        words = sorted(set(lexicon) | NEGATIONS | set(BOOSTERS))
+        # Words are looked up by hash, with a binary search over the sorted hashes of the vocabulary
+        hashes = _tokenize(_encode(words))["hashes"]
+        order = np.argsort(hashes)
+        self._hashes = hashes[order]
+        words = [words[i] for i in order]
+        self._valences = np.array([lexicon.get(word, 0.0) for word in words])
+        self._is_negation = np.array([word in NEGATIONS for word in words])
+        self._boosts = np.array([BOOSTERS.get(word, 0.0) for word in words])
+
+    @classmethod
+    def from_file(cls, path: str) -> "LexiconSentiment":
+        lexicon = {}
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                fields = line.rstrip("\n").split("\t")
+                # Multi-word entries and emoticons cannot match a single word
+                if len(fields) >= 2 and fields[0].isalpha():
+                    try:
+                        lexicon[fields[0].lower()] = float(fields[1])
+                    except ValueError:
+                        continue
+        return cls(lexicon)
+
+    def analyze_many(self, texts: list[str]) -> list[tuple[float, float]]:
+        if not texts:
+            return []
+        tokens = _tokenize(_encode(texts))
+        sentence_ids = tokens["sentences"]
+
+        # Vocabulary lookup
+        positions = np.minimum(np.searchsorted(self._hashes, tokens["hashes"]), len(self._hashes) - 1)
+        known = self._hashes[positions] == tokens["hashes"]
+        valences = np.where(known, self._valences[positions], 0.0)
+        negation = known & self._is_negation[positions]
+        boosts = np.where(known, self._boosts[positions], 0.0)
+
+        # A booster right before a word pushes its valence away from zero
+        previous_boost = np.zeros_like(boosts)
+        previous_boost[1:] = np.where(sentence_ids[1:] == sentence_ids[:-1], boosts[:-1], 0.0)
+        valences = valences + np.sign(valences) * previous_boost
+
+        # A negation within the previous words of the same sentence flips and dampens the valence
+        negated = np.zeros_like(negation)
+        for shift in range(1, NEGATION_WINDOW + 1):
+            negated[shift:] |= negation[:-shift] & (sentence_ids[shift:] == sentence_ids[:-shift])
+        valences = np.where(negated, valences * NEGATION_SCALAR, valences)
+
+        # Summed valence of each sentence, normalized into [-1, 1]
+        sentence_count = tokens["sentence_count"]
+        raw = np.bincount(sentence_ids, weights=valences, minlength=sentence_count)
+        has_words = np.bincount(sentence_ids, minlength=sentence_count) > 0
+        sentence_scores = raw / np.sqrt(raw * raw + ALPHA)
+        sentence_documents = np.zeros(sentence_count, dtype=np.int64)
+        sentence_documents[sentence_ids] = tokens["documents"]
+
+        # Like Cloud NL, the document score averages its sentences and the magnitude sums their strength
+        document_sentences = np.bincount(sentence_documents, weights=has_words, minlength=len(texts))
+        document_sums = np.bincount(sentence_documents, weights=sentence_scores, minlength=len(texts))
+        magnitudes = np.bincount(sentence_documents, weights=np.abs(sentence_scores), minlength=len(texts))
+        scores = np.divide(document_sums, document_sentences, out=np.zeros(len(texts)), where=document_sentences > 0)
+
+        return [(round(float(score), 3), round(float(magnitude), 3)) for score, magnitude in zip(scores, magnitudes)]
+
+class CloudSentiment(SentimentBackend):
+    """
+    Cloud Natural Language API, one request per document, sent concurrently.
+    Documents the API fails on are scored by the local engine instead.
+    """
+    name = "cloud"
+
+    def __init__(self, fallback: SentimentBackend, max_workers: int = SENTIMENT_CLOUD_WORKERS):
+        self.fallback = fallback
+        self.max_workers = max_workers
+
+    def _analyze_one(self, text: str) -> tuple[float, float] | None:
+        try:
+            from google.cloud import language_v1
+            from utils.models import get_language_client
+
+            document = language_v1.Document(content=text, type_=language_v1.Document.Type.PLAIN_TEXT)
+            response = get_language_client().analyze_sentiment(request={'document': document})
+            return response.document_sentiment.score, response.document_sentiment.magnitude
+        except Exception as e:
+            logger.warning(f"Cloud sentiment analysis failed, using the local engine: {e}")
+            return None
+
+    def analyze_many(self, texts: list[str]) -> list[tuple[float, float]]:
+        if not texts:
+            return []
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(texts))) as executor:
+            results = list(executor.map(self._analyze_one, texts))
+
+        failed = [i for i, result in enumerate(results) if result is None]
+        for i, result in zip(failed, self.fallback.analyze_many([texts[i] for i in failed])):
+            results[i] = result
+        return results
+
+_backend = None
+_backend_lock = threading.Lock()
+
+def get_sentiment_backend() -> SentimentBackend:
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            local = LexiconSentiment.from_file(SENTIMENT_LEXICON) if SENTIMENT_LEXICON else LexiconSentiment()
+            if SENTIMENT_BACKEND == "cloud":
+                _backend = CloudSentiment(fallback=local)
+            else:
+                if SENTIMENT_BACKEND != "local":
+                    logger.warning(f"Unknown SENTIMENT_BACKEND {SENTIMENT_BACKEND!r}, using the local engine")
+                _backend = local
+        return _backend
@@ -0,0 +1,176 @@
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+from typing import Any, Optional
+
+from google.adk.events import Event
+from google.adk.sessions import InMemorySessionService, Session
+from typing_extensions import override
+
+logger = logging.getLogger(__name__)
+
+# Above this estimated size, the oldest tool payloads of a session are compacted even before they are consumed
+SESSION_MAX_BYTES = int(os.getenv("SESSION_MAX_BYTES", str(4 * 1024 * 1024)))
+# Sessions not updated for this many seconds are evicted, runs that never cleaned up included
+SESSION_TTL = float(os.getenv("SESSION_TTL", "1800"))
+# Tool responses larger than this are compacted once consumed
+SESSION_COMPACT_CHARS = int(os.getenv("SESSION_COMPACT_CHARS", "2000"))
+PREVIEW_CHARS = 200
+SWEEP_INTERVAL = 60.0
+
+def _response_size(response: Any) -> int:
+    if isinstance(response, dict) and len(response) == 1 and isinstance(response.get("result"), str):
+        return len(response["result"])
+    return len(json.dumps(response, default=str))
+
+def event_size(event: Event) -> int:
+    """Rough size of what an event keeps in memory: its texts and tool payloads, in characters."""
+    if not event.content or not event.content.parts:
+        return 0
+    size = 0
+    for part in event.content.parts:
+        if part.text:
+            size += len(part.text)
+        if part.function_call and part.function_call.args:
+            size += len(json.dumps(part.function_call.args, default=str))
+        if part.function_response and part.function_response.response is not None:
+            size += _response_size(part.function_response.response)
+    return size
+
+def digest(response: Any) -> dict:
+    """What is left of a compacted tool response: a fingerprint, its size and the start of it."""
+    if isinstance(response, dict) and isinstance(response.get("result"), str):
+        payload = response["result"]
+    else:
+        payload = json.dumps(response, default=str)
+    return {
+        "compacted": True,
+        "sha256": hashlib.sha256(payload.encode()).hexdigest()[:16],
+        "chars": len(payload),
+        "preview": payload[:PREVIEW_CHARS]
+    }
+
+class BoundedSessionService(InMemorySessionService):
+    """
+    In-memory sessions with bounded memory, to be shared by every run of a process.
+
+    - A tool response larger than `compact_over` is replaced by its digest once consumed, that is once
+      the agent that called the tool gave its final response. Later stages only see the digest too.
+    - A session above `max_session_bytes` has its oldest large tool responses compacted right away.
+    - Sessions idle for longer than `ttl` seconds are evicted.
+    Runs are still expected to delete their session when they are done.
+    """
+
+    def __init__(self, max_session_bytes: int = SESSION_MAX_BYTES, ttl: float = SESSION_TTL,
+                 compact_over: int = SESSION_COMPACT_CHARS):
+        super().__init__()
+        self.max_session_bytes = max_session_bytes
+        self.ttl = ttl
+        self.compact_over = compact_over
+        self._sizes = {}
+        self._lock = threading.Lock()
+        self._last_sweep = time.time()
+        self.compacted = 0
+        self.evicted = 0
+
+    @override
+    async def create_session(self, *, app_name: str, user_id: str, state: Optional[dict[str, Any]] = None,
+                             session_id: Optional[str] = None) -> Session:
+        self.evict_expired()
+        return await super().create_session(app_name=app_name, user_id=user_id, state=state, session_id=session_id)
+
+    @override
+    async def append_event(self, session: Session, event: Event) -> Event:
+        event = await super().append_event(session=session, event=event)
+        storage_session = self.sessions.get(session.app_name, {}).get(session.user_id, {}).get(session.id)
+        if event.partial or storage_session is None:
+            return event
+
+        key = (session.app_name, session.user_id, session.id)
+        with self._lock:
+            self._sizes[key] = self._sizes.get(key, 0) + event_size(event)
+
+        # The caller's copy of the session builds the next model requests, it is compacted too
+        copies = [storage_session] if storage_session is session else [storage_session, session]
+        if event.is_final_response():
+            self._compact(key, copies, lambda e: e.author == event.author)
+        if self._sizes.get(key, 0) > self.max_session_bytes:
+            self._compact(key, copies, lambda e: True, until=self.max_session_bytes)
+            if self._sizes.get(key, 0) > self.max_session_bytes:
+                logger.warning(f"Session {session.id} holds {self._sizes[key]} bytes, above the {self.max_session_bytes} cap")
+
+        if time.time() - self._last_sweep > SWEEP_INTERVAL:
+            self.evict_expired()
+        return event
+
+    def _compact(self, key: tuple, copies: list[Session], select, until: int | None = None):
+        compacted_ids = set()
+        for e in copies[0].events:
+            if until is not None and self._sizes.get(key, 0) <= until:
+                break
+            if not select(e) or not e.content or not e.content.parts:
+                continue
+            for part in e.content.parts:
+                response = part.function_response.response if part.function_response else None
+                if response is None or response.get("compacted") or _response_size(response) <= self.compact_over:
+                    continue
+                compact = digest(response)
+                with self._lock:
+                    self._sizes[key] = self._sizes.get(key, 0) - _response_size(response) + _response_size(compact)
+                part.function_response.response = compact
+                compacted_ids.add(e.id)
+                self.compacted += 1
+
+        # With deep copies, the other copies hold their own event objects
+        for session in copies[1:]:
+            for e in session.events:
+                if e.id in compacted_ids and e.content:
+                    for part in e.content.parts or []:
+                        response = part.function_response.response if part.function_response else None
+                        if response is not None and not response.get("compacted") and _response_size(response) > self.compact_over:
+                            part.function_response.response = digest(response)
+
+    @override
+    async def delete_session(self, *, app_name: str, user_id: str, session_id: str) -> None:
+        await super().delete_session(app_name=app_name, user_id=user_id, session_id=session_id)
+        with self._lock:
+            self._sizes.pop((app_name, user_id, session_id), None)
+
+    def evict_expired(self):
+        now = time.time()
+        self._last_sweep = now
+        for app_name, users in list(self.sessions.items()):
+            for user_id, sessions in list(users.items()):
+                for session_id, session in list(sessions.items()):
+                    if now - session.last_update_time > self.ttl:
+                        sessions.pop(session_id, None)
+                        with self._lock:
+                            self._sizes.pop((app_name, user_id, session_id), None)
+                        self.evicted += 1
+                if not sessions:
+                    users.pop(user_id, None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            sizes = list(self._sizes.values())
+        return {
+            "sessions": len(sizes),
+            "bytes": sum(sizes),
+            "largest_session_bytes": max(sizes, default=0),
+            "compacted_payloads": self.compacted,
+            "evicted_sessions": self.evicted
+        }
+
+_service = None
+_service_lock = threading.Lock()
+
+def get_session_service() -> BoundedSessionService:
+    """The session service shared by every agent run of the process."""
+    global _service
+    with _service_lock:
+        if _service is None:
+            _service = BoundedSessionService()
+        return _service
@@ -0,0 +1,161 @@
+import json
+import time
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Any
+
+from utils.env import getenv
+
+# With several uvicorn workers, rate limits, quotas and caches have to live outside the
+# worker processes, otherwise each worker enforces them on its own.
+# Setting SHARED_STATE_PATH stores them in a SQLite database shared by every worker.
+
+class LocalState:
+    """
+    State of a single process, used when only one worker is running.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._slots = {}
+        self._cache = {}
+
+    def incr_below(self, key: str, limit: int, window: float | None = None) -> bool:
+        """Increment the counter unless it already reached `limit` in the current window."""
+        now = time.time()
+        with self._lock:
+            window_start, count = self._counters.get(key, (now, 0))
+            if window is not None and now - window_start >= window:
+                window_start, count = now, 0
+            if count >= limit:
+                return False
+            self._counters[key] = (window_start, count + 1)
+            return True
+
+    def decr(self, key: str):
+        """Give back one increment of `incr_below`, the counter never goes below zero."""
+        with self._lock:
+            if key in self._counters:
+                window_start, count = self._counters[key]
+                self._counters[key] = (window_start, max(count - 1, 0))
+
+    def count(self, key: str, window: float | None = None) -> int:
+        with self._lock:
+            window_start, count = self._counters.get(key, (0.0, 0))
+            if window is not None and time.time() - window_start >= window:
+                return 0
+            return count
+
+    def reserve_slot(self, key: str, interval: float) -> float:
+        """Reserve the next start time spaced `interval` seconds from the previous one, return the wait."""
+        now = time.time()
+        with self._lock:
+            start = max(now, self._slots.get(key, 0.0))
+            self._slots[key] = start + interval
+            return start - now
+
+    def cache_get(self, key: str) -> Any | None:
+        with self._lock:
+            value, expires_at = self._cache.get(key, (None, None))
+            if expires_at is not None and expires_at < time.time():
+                del self._cache[key]
+                return None
+            return value
+
+    def cache_set(self, key: str, value: Any, ttl: float | None = None):
+        with self._lock:
+            self._cache[key] = (value, time.time() + ttl if ttl else None)
+
+    def cache_has(self, key: str) -> bool:
+        return self.cache_get(key) is not None
+
+class SqliteState(LocalState):
+    """
+    State shared by every process opening the same SQLite file.
+    The database runs in WAL mode so readers never wait on writers, and every
+    read-modify-write runs in a BEGIN IMMEDIATE transaction to be atomic across processes.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        with self._transaction() as db:
+            db.execute("CREATE TABLE IF NOT EXISTS counters (key TEXT PRIMARY KEY, window_start REAL, count INTEGER)")
+            db.execute("CREATE TABLE IF NOT EXISTS slots (key TEXT PRIMARY KEY, next_at REAL)")
+            db.execute("CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value TEXT, expires_at REAL)")
+
+    @property
+    def _db(self) -> sqlite3.Connection:
+        # sqlite3 connections cannot be shared between threads
+        if getattr(self._local, "db", None) is None:
+            db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            self._local.db = db
+        return self._local.db
+
+    @contextmanager
+    def _transaction(self):
+        db = self._db
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            yield db
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        db.execute("COMMIT")
+
+    def incr_below(self, key: str, limit: int, window: float | None = None) -> bool:
+        now = time.time()
+        with self._transaction() as db:
+            row = db.execute("SELECT window_start, count FROM counters WHERE key = ?", (key,)).fetchone()
+            window_start, count = row if row else (now, 0)
+            if window is not None and now - window_start >= window:
+                window_start, count = now, 0
+            if count >= limit:
+                return False
+            db.execute("INSERT OR REPLACE INTO counters VALUES (?, ?, ?)", (key, window_start, count + 1))
+            return True
+
+    def decr(self, key: str):
+        with self._transaction() as db:
+            db.execute("UPDATE counters SET count = MAX(count - 1, 0) WHERE key = ?", (key,))
+
+    def count(self, key: str, window: float | None = None) -> int:
+        row = self._db.execute("SELECT window_start, count FROM counters WHERE key = ?", (key,)).fetchone()
+        if row is None or (window is not None and time.time() - row[0] >= window):
+            return 0
+        return row[1]
+
+    def reserve_slot(self, key: str, interval: float) -> float:
+        now = time.time()
+        with self._transaction() as db:
+            row = db.execute("SELECT next_at FROM slots WHERE key = ?", (key,)).fetchone()
+            start = max(now, row[0] if row else 0.0)
+            db.execute("INSERT OR REPLACE INTO slots VALUES (?, ?)", (key, start + interval))
+            return start - now
+
+    def cache_get(self, key: str) -> Any | None:
+        row = self._db.execute("SELECT value, expires_at FROM cache WHERE key = ?", (key,)).fetchone()
+        if row is None or (row[1] is not None and row[1] < time.time()):
+            return None
+        return json.loads(row[0])
+
+    def cache_set(self, key: str, value: Any, ttl: float | None = None):
+        expires_at = time.time() + ttl if ttl else None
+        with self._transaction() as db:
+            db.execute("INSERT OR REPLACE INTO cache VALUES (?, ?, ?)", (key, json.dumps(value), expires_at))
+            db.execute("DELETE FROM cache WHERE expires_at IS NOT NULL AND expires_at < ?", (time.time(),))
+
+_state = None
+_state_lock = threading.Lock()
+
+def get_shared_state() -> LocalState:
+    global _state
+    with _state_lock:
+        if _state is None:
+            path = getenv("SHARED_STATE_PATH")
+            _state = SqliteState(path) if path else LocalState()
+        return _state
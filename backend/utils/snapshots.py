@@ -0,0 +1,52 @@
+import os
+import json
+import hashlib
+import tempfile
+from utils.env import getenv
+
+backend_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def fingerprint(text: str) -> str:
+    """Content fingerprint that ignores whitespace-only changes."""
+    return hashlib.sha256(" ".join(text.split()).encode()).hexdigest()
+
+def diff_sources(previous: dict[str, str], current: dict[str, str]) -> dict[str, list[str]]:
+    """
+    Compare two {source: fingerprint} maps and sort the sources into
+    new, changed, unchanged and removed.
+    """
+    return {
+        "new": [source for source in current if source not in previous],
+        "changed": [source for source in current if source in previous and previous[source] != current[source]],
+        "unchanged": [source for source in current if source in previous and previous[source] == current[source]],
+        "removed": [source for source in previous if source not in current],
+    }
+
+class SnapshotStore:
+    """
+    Keeps the last analysis of each query, with its per-source fingerprints and partial
+    analyses, so a refresh only has to reprocess the sources that changed.
+    One JSON file per analysis.
+    """
+
+    def __init__(self, directory: str | None = None):
+        self.directory = directory or getenv("SNAPSHOT_DIR", os.path.join(backend_root, ".snapshots"))
+
+    def _path(self, namespace: str, key: str) -> str:
+        digest = hashlib.sha1(f"{namespace}:{key}".encode()).hexdigest()
+        return os.path.join(self.directory, f"{namespace}_{digest}.json")
+
+    def load(self, namespace: str, key: str) -> dict | None:
+        try:
+            with open(self._path(namespace, key)) as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def save(self, namespace: str, key: str, snapshot: dict):
+        os.makedirs(self.directory, exist_ok=True)
+        # Written to a temporary file first, a concurrent reader never sees half a snapshot
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump(snapshot, f)
+        os.replace(tmp_path, self._path(namespace, key))